@@ -9,17 +9,31 @@ __all__ = [
     "logger",
 ]
 
+def classify_pdf(
+    pdf_path: str,
+    samples: int = 8,
+    min_chars: int = 20
+) -> str:
+    """Classify a pdf as "text", "scanned" or "mixed" from evenly sampled pages"""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        total = doc.page_count
+        if total == 0:
+            return "text"
+        step = max(total / samples, 1)
+        pages = sorted({int(i * step) for i in range(min(samples, total))})
+        has_text = [len(doc[pg].get_text().strip()) >= min_chars for pg in pages]
+
+    if all(has_text):
+        return "text"
+    if not any(has_text):
+        return "scanned"
+    return "mixed"
+
 def is_text_pdf(
     pdf_path: str
 ) -> bool:
-    import fitz
-    doc = fitz.open(pdf_path)
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text()
-        if text.strip():
-            return True
-    return False
+    return classify_pdf(pdf_path) != "scanned"
 
 def hashstr(
     input_string: str,
@@ -29,5 +43,5 @@ def hashstr(
     import hashlib
     if with_salt:
         input_string += str(time.time() + random.random())
-    hash = hash.md5(str(input_string).encode()).hexdigest()
+    hash = hashlib.md5(str(input_string).encode()).hexdigest()
     return hash[:length]
\ No newline at end of file
@@ -1,20 +1,115 @@
 import os
+import re
 from pathlib import Path
+from functools import lru_cache
 from llama_index.core import Document
 from llama_index.core.node_parser import SimpleFileNodeParser
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.readers.file import FlatReader, DocxReader
 from src.common import hashstr
 
-def chunk(text_or_path, params=None):
+# a sentence ends with 。！？；(or their ascii forms), the closing quotes/brackets after them and line breaks
+SENTENCE_PATTERN = re.compile(r"[^。！？；!?;\n]+[。！？；!?;]*[”’」』）)]*\n*|[。！？；!?;\n]+[”’」』）)]*\n*")
+SENTENCE_MARKS = set("。！？；!?;\n”’」』）)")
+
+class TextChunk:
+    """A chunk of text with its character offsets in the whole document"""
+
+    def __init__(self, text, start_char_idx, end_char_idx):
+        self.text = text
+        self.start_char_idx = start_char_idx
+        self.end_char_idx = end_char_idx
+        self.id_ = hashstr(f"{start_char_idx}:{text}")
+
+    def to_dict(self):
+        return {
+            "id_": self.id_,
+            "text": self.text,
+            "start_char_idx": self.start_char_idx,
+            "end_char_idx": self.end_char_idx,
+        }
+
+def split_sentences(text):
+    """Split text into sentences on Chinese / ascii punctuation, "".join(result) == text"""
+    return SENTENCE_PATTERN.findall(text)
+
+def iter_sentences(segments, max_length=500):
+    """Yield (sentence, offset) from an iterator of text segments, sentences longer than `max_length` are cut.
+    The last sentence of a segment may continue in the next one (more text, closing quotes, line breaks),
+    it is held back until then, so the result does not depend on where the text is split into segments."""
+    offset = 0
+    tail = ""
+    for segment in segments:
+        sentences = split_sentences(tail + segment)
+        tail = sentences.pop() if sentences else ""
+
+        # the whole `max_length` pieces of a long tail are final already, it is cut where the
+        # rest still splits the same, inside the leading run of plain characters
+        cut = (len(tail) - 1) // max_length * max_length
+        while cut > 0 and tail[cut] in SENTENCE_MARKS:
+            cut -= max_length
+        if cut > 0:
+            sentences.append(tail[:cut])
+            tail = tail[cut:]
+
+        for sentence in sentences:
+            for i in range(0, len(sentence), max_length):
+                yield sentence[i:i + max_length], offset + i
+            offset += len(sentence)
+
+    for i in range(0, len(tail), max_length):
+        yield tail[i:i + max_length], offset + i
+
+def chunk_stream(segments, params=None):
+    """
+    Chunk an iterator of text segments (pages, lines...) with bounded memory.
+    Chunks hold whole sentences up to `chunk_size` characters and start with the last
+    sentences of the previous chunk up to `chunk_overlap` characters.
+    """
     params = params or {}
     chunk_size = int(params.get("chunk_size", 500))
-    chunk_overlap = int(params.get("chunk_overlap", 20))
-    splitter = SentenceSplitter(
+    chunk_overlap = min(int(params.get("chunk_overlap", 20)), chunk_size // 2)
+
+    window = []  # [(sentence, offset)] of the current chunk
+    size = 0
+    fresh = False  # whether the window holds sentences not yet emitted
+    for sentence, offset in iter_sentences(segments, max_length=chunk_size):
+        if window and size + len(sentence) > chunk_size:
+            if fresh:
+                yield TextChunk("".join(s for s, _ in window), window[0][1], offset)
+
+            overlap = []
+            overlap_size = 0
+            for s, o in reversed(window):
+                if overlap_size + len(s) > chunk_overlap or overlap_size + len(s) + len(sentence) > chunk_size:
+                    break
+                overlap.insert(0, (s, o))
+                overlap_size += len(s)
+            window, size, fresh = overlap, overlap_size, False
+
+        window.append((sentence, offset))
+        size += len(sentence)
+        fresh = True
+
+    if window and fresh:
+        yield TextChunk("".join(s for s, _ in window), window[0][1], window[-1][1] + len(window[-1][0]))
+
+@lru_cache(maxsize=16)
+def get_splitter(chunk_size, chunk_overlap):
+    return SentenceSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
 
+def chunk(text_or_path, params=None):
+    params = params or {}
+    chunk_size = int(params.get("chunk_size", 500))
+    chunk_overlap = int(params.get("chunk_overlap", 20))
+    splitter = get_splitter(chunk_size, chunk_overlap)
+
+    if params.get("chunk_method") == "native" and not os.path.isfile(text_or_path):
+        return list(chunk_stream([text_or_path], params))
+
     if os.path.isfile(text_or_path) and "uploads" in text_or_path:
         parser = SimpleFileNodeParser()
         file_type = Path(text_or_path).suffix.lower()
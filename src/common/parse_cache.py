@@ -0,0 +1,168 @@
+import os
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .logger import setup_logger
+
+logger = setup_logger("ParseCache")
+
+class ParseCache:
+    """
+    Content-addressed cache of the text extracted from documents, shared by
+    `read_text`, `pdf2txt` and `/tool/pdf2txt`. Entries are keyed by the sha256 of the file:
+
+        <cache_dir>/<digest[:2]>/<digest>/document.txt
+        <cache_dir>/<digest[:2]>/<digest>/pages/<page>.txt
+
+    When the cache grows over `max_bytes`, the least recently used documents are evicted.
+    """
+
+    def __init__(self, cache_dir="saves/cache/parse", max_bytes=1 << 30, max_digests=4096):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_digests = max_digests
+        self.lock = threading.Lock()
+        self.digests = OrderedDict()  # (path, mtime, size) -> digest, least recently used first
+        self.size = None
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        with self.lock:
+            if key in self.digests:
+                self.digests.move_to_end(key)
+                return self.digests[key]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+
+        with self.lock:
+            self.digests[key] = sha.hexdigest()
+            while len(self.digests) > self.max_digests:
+                self.digests.popitem(last=False)
+        return sha.hexdigest()
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _read(self, digest, *parts):
+        path = os.path.join(self._entry_dir(digest), *parts)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(self._entry_dir(digest))  # mark the document as recently used
+            return text
+        except OSError:
+            return None
+
+    def _write(self, digest, text, *parts):
+        path = os.path.join(self._entry_dir(digest), *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self._commit(tmp_path, path)
+
+    def _commit(self, tmp_path, path):
+        added = os.path.getsize(tmp_path)
+        try:
+            added -= os.path.getsize(path)  # an overwritten entry only grows the cache by the difference
+        except OSError:
+            pass
+        os.replace(tmp_path, path)  # atomic, concurrent writers may share the cache
+        self._evict(added)
+
+    def get_document(self, digest):
+        return self._read(digest, "document.txt")
+
+    def open_document(self, digest):
+        """The cached document as an open text file to be read piece by piece, None on a miss"""
+        path = os.path.join(self._entry_dir(digest), "document.txt")
+        try:
+            f = open(path, "r", encoding="utf-8")
+        except OSError:
+            return None
+        os.utime(self._entry_dir(digest))  # mark the document as recently used
+        return f
+
+    def put_document(self, digest, text):
+        self._write(digest, text, "document.txt")
+
+    @contextmanager
+    def write_document(self, digest):
+        """Write a document piece by piece through the yielded file, so that it is never held
+        in memory as one string. It is only cached when the block exits without error."""
+        path = os.path.join(self._entry_dir(digest), "document.txt")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                yield f
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._commit(tmp_path, path)
+
+    def get_page(self, digest, page):
+        return self._read(digest, "pages", f"{page}.txt")
+
+    def put_page(self, digest, page, text):
+        self._write(digest, text, "pages", f"{page}.txt")
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if os.path.isdir(prefix_dir):
+                entries.extend(os.path.join(prefix_dir, digest) for digest in os.listdir(prefix_dir))
+        return entries
+
+    def _entry_size(self, entry_dir):
+        total = 0
+        for root, _, files in os.walk(entry_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _mtime(self, entry_dir):
+        try:
+            return os.path.getmtime(entry_dir)
+        except OSError:
+            return 0
+
+    def _evict(self, added):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(self._entry_size(entry) for entry in self._entries())
+            else:
+                self.size += added
+
+            if self.size <= self.max_bytes:
+                return
+
+            entries = sorted(self._entries(), key=self._mtime)
+            for entry in entries:
+                if self.size <= self.max_bytes * 0.9:
+                    break
+                self.size -= self._entry_size(entry)
+                shutil.rmtree(entry, ignore_errors=True)
+                logger.info(f"Evicted {os.path.basename(entry)} from parse cache")
+
+    def stats(self):
+        return {"cache_dir": self.cache_dir, "size": self.size, "max_bytes": self.max_bytes}
+
+PARSE_CACHE = ParseCache(
+    cache_dir=os.getenv("PARSE_CACHE_DIR", os.path.join("saves", "cache", "parse")),
+    max_bytes=int(float(os.getenv("PARSE_CACHE_MAX_MB", 1024)) * (1 << 20)))
@@ -0,0 +1,57 @@
+"""
+Parsing of a single file into chunk texts, run by the parse workers of the ingestion pipeline.
+Only the reader and the chunker are imported here, so that spawned workers do not load
+the models and database clients imported by `src.core`.
+"""
+import sys
+
+
+def parse_file(path, file_type, params=None, progress=None):
+    """Read and chunk one file and return the chunk texts, with the llama_index splitter
+    unless params["chunk_method"] == "native" (the streaming sentence chunker).
+    progress(stage, current=None, total=None) reports reading / OCR / chunking"""
+    from src.common.chunker import chunk, chunk_stream
+    params = params or {}
+    progress = progress or (lambda *args, **kwargs: None)
+
+    progress("reading")
+    if file_type in ["pdf", "txt", "md"] and params.get("chunk_method") == "native":
+        # pages / lines are chunked as they are read, the document is never held as one string
+        from src.common.reader import iter_text
+        return [c.text for c in chunk_stream(iter_text(path, progress=progress), params)]
+
+    if file_type == "pdf" or "uploads" not in path:
+        # the chunker only reads the files under the uploads directory by itself
+        from src.common.reader import read_text
+        text = read_text(path, progress=progress)
+        progress("chunking")
+        nodes = chunk(text, params=params)
+    else:
+        progress("chunking")
+        nodes = chunk(path, params=params)
+    return [node.text for node in nodes]
+
+
+def parse_file_in_worker(events, file_id, path, file_type, params=None):
+    """`parse_file` in a worker process, the progress is sent to `events` as
+    ("progress", (file_id, stage, current, total)), the pages OCR-ed meanwhile as ("ocr", {...})"""
+    def progress(stage, current=None, total=None):
+        events.put(("progress", (file_id, stage, current, total)))
+
+    ocr = _ocr_service()
+    pages, loaded = (ocr.pages, ocr.engine is not None) if ocr else (0, False)
+    try:
+        return parse_file(path, file_type, params, progress=progress)
+    finally:
+        # the OCR module is only imported by the worker once a page needs it
+        ocr = _ocr_service()
+        if ocr and ocr.pages > pages:
+            events.put(("ocr", {
+                "page_times": list(ocr.page_times)[-(ocr.pages - pages):],
+                "load_time": ocr.load_time if not loaded else None,
+            }))
+
+
+def _ocr_service():
+    module = sys.modules.get("src.plugins.pdf2txt")
+    return module.OCR_SERVICE if module else None
@@ -0,0 +1,135 @@
+import os
+from pathlib import Path
+
+from src.common import setup_logger, classify_pdf
+
+logger = setup_logger("Reader")
+
+"""
+Some tips for you:
+This is just a simple PDF reader that uses PyMuPDF to extract text from PDFs.
+But if you have enough GPU resources, I strongly recommend using the OLM OCR model to extract text from PDFs.
+It has much better performance than the other PDF reader libs. The only problem is that it is required to use high-end GPU.
+
+- Recent NVIDIA GPU (tested on RTX 4090, L40S, A100, H100, A6000...) with at least 20 GB of GPU RAM
+- Follow: https://github.com/allenai/olmocr
+"""
+
+def iter_pdf_pages(file_path:str, progress=None, min_chars:int=20, kind:str=None):
+    """Yield the text of every page in a single PyMuPDF pass.
+    A page without a text layer is OCR-ed when it holds images or when the document is "mixed",
+    so the blank and title pages of text documents are not sent to OCR.
+    `kind` is the `classify_pdf` result when the caller already has it."""
+    assert os.path.exists(file_path), "File does not exist"
+    assert file_path.endswith(".pdf"), "File format not supported"
+
+    import fitz
+    from src.common.parse_cache import PARSE_CACHE
+    digest = PARSE_CACHE.file_hash(file_path)
+    use_ocr = True
+
+    with fitz.open(file_path) as doc:
+        total = doc.page_count
+        for pg in range(total):
+            page = doc[pg]
+            text = page.get_text()
+            if use_ocr and len(text.strip()) < min_chars:
+                kind = kind or classify_pdf(file_path, min_chars=min_chars)
+                if kind == "mixed" or page.get_images():
+                    try:
+                        from src.plugins.pdf2txt import ocr_page
+                        if progress:
+                            progress("ocr", pg + 1, total)
+                        text = ocr_page(file_path, pg, digest=digest) or text
+                    except ImportError as e:
+                        logger.warning(f"OCR not available, keep the text layer of image pages: {e}")
+                        use_ocr = False
+            yield text
+
+def pdfreader(file_path:str, progress=None, kind:str=None)->str:
+    return "\n\n".join(iter_pdf_pages(file_path, progress=progress, kind=kind))
+
+def plainreader(file_path:str)->str:
+    assert os.path.exists(file_path), "File does not exist"
+    with open(file_path, "r") as f:
+        text = f.read()
+    return text
+
+def read_text(file:str, progress=None)->str:
+    """Read the text of a pdf / txt / md file, scanned pdfs are sent to OCR"""
+    support_format = [".pdf", ".txt", ".md"]
+    assert os.path.exists(file), "File not found"
+    logger.info(f"Try to read file {file}")
+
+    if not os.path.isfile(file):
+        logger.error(f"Directory not supported now!")
+        raise NotImplementedError("Directory not supported now!")
+
+    if file.endswith(".pdf"):
+        from src.common.parse_cache import PARSE_CACHE
+        digest = PARSE_CACHE.file_hash(file)
+        text = PARSE_CACHE.get_document(digest)
+        if text is not None:
+            logger.info(f"Read {file} from parse cache {digest[:8]}")
+            return text
+
+        kind = classify_pdf(file)
+        if kind != "scanned":
+            text = pdfreader(file, progress=progress, kind=kind)
+            PARSE_CACHE.put_document(digest, text)
+            return text
+        else:
+            from src.plugins import pdf2txt
+            return pdf2txt(file, return_text=True, progress=progress)
+
+    elif file.endswith(".txt") or file.endswith(".md"):
+        return plainreader(file)
+
+    else:
+        logger.error(f"File format not supported, only support {support_format}")
+        raise Exception(f"File format not supported, only support {support_format}")
+
+def iter_text(file:str, progress=None, block_size:int=1 << 16):
+    """Yield the text of a pdf / txt / md file segment by segment (pages or blocks of lines),
+    so that large documents never have to be held in memory as one string"""
+    assert os.path.exists(file), "File not found"
+
+    if file.endswith(".pdf"):
+        from src.common.parse_cache import PARSE_CACHE
+        digest = PARSE_CACHE.file_hash(file)
+        cached = PARSE_CACHE.open_document(digest)
+        if cached is not None:
+            with cached:
+                yield from iter_blocks(cached, block_size)
+        elif (kind := classify_pdf(file)) == "scanned":
+            yield read_text(file, progress=progress)
+        else:
+            # pages are appended to the cache entry as they are read, it is committed after the last one.
+            # They are separated by "\n\n" like in pdfreader, so streamed and cached text are identical
+            with PARSE_CACHE.write_document(digest) as entry:
+                for pg, page in enumerate(iter_pdf_pages(file, progress=progress, kind=kind)):
+                    if pg > 0:
+                        entry.write("\n\n")
+                        yield "\n\n"
+                    entry.write(page)
+                    yield page
+
+    elif file.endswith(".txt") or file.endswith(".md"):
+        with open(file, "r") as f:
+            yield from iter_blocks(f, block_size)
+
+    else:
+        yield read_text(file, progress=progress)
+
+def iter_blocks(f, block_size:int=1 << 16):
+    """Yield the lines of an open text file grouped in blocks of about `block_size` characters"""
+    block = []
+    size = 0
+    for line in f:
+        block.append(line)
+        size += len(line)
+        if size >= block_size:
+            yield "".join(block)
+            block, size = [], 0
+    if block:
+        yield "".join(block)
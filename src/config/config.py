@@ -57,6 +57,38 @@ class Config(SimpleConfig):
         self.add_item("embedding", default="bge-m3", des="Embedding Model", choices=list(EMBED_MODEL_INFO.keys()))
         self.add_item("reranker", default="bge-reranker-v2-m3", des="Re-Ranker Model", choices=list(RERANKER_LIST.keys()))
         self.add_item("model_local_paths", default={}, des="Local Model Paths")
+        self.add_item("ingest_workers", default=2, des="Workers of File Ingestion Queue")
+        self.add_item("embed_batch_size", default=64, des="Chunks per Batch for Document Embedding")
+        self.add_item("parse_workers", default=4, des="Processes for Document Parsing")
+        self.add_item("insert_batch_size", default=1000, des="Rows per Batch for Milvus Insertion")
+        self.add_item("ingest_queue_size", default=8, des="Queue Size between Ingestion Stages")
+        self.add_item("chunk_method", default="sentence", des="Default Chunker, native streams pdf/txt/md files", choices=["sentence", "native"])
+        self.add_item("vector_index_type", default="HNSW", des="Vector Index Type", choices=["HNSW", "IVF_FLAT", "IVF_PQ", "FLAT", "AUTOINDEX"])
+        self.add_item("vector_index_params", default={"M": 16, "efConstruction": 200}, des="Vector Index Build Parameters")
+        self.add_item("vector_metric_type", default="COSINE", des="Vector Metric Type", choices=["COSINE", "IP", "L2"])
+        self.add_item("enable_hybrid_search", default=True, des="Store BM25 Sparse Vectors for Hybrid Search")
+        self.add_item("search_mode", default="dense", des="Default Knowledge Base Search Mode, hybrid also ranks by BM25", choices=["dense", "hybrid"])
+        self.add_item("hybrid_ranker", default="rrf", des="Fusion of Dense and Sparse Results", choices=["rrf", "weighted"])
+        self.add_item("hybrid_dense_weight", default=0.6, des="Dense Weight of Weighted Fusion")
+        self.add_item("enable_embedding_cache", default=True, des="Enable Embedding Cache")
+        self.add_item("embedding_cache_size", default=10000, des="Max Vectors in Embedding Cache")
+        self.add_item("embedding_cache_persist", default=False, des="Persist Embedding Cache to Disk")
+        self.add_item("enable_response_cache", default=False, des="Enable Response Cache")
+        self.add_item("response_cache_mode", default="exact", des="Response Cache Mode", choices=["exact", "semantic"])
+        self.add_item("response_cache_threshold", default=0.95, des="Similarity Threshold of Semantic Response Cache")
+        self.add_item("response_cache_ttl", default=3600, des="Response Cache TTL (s)")
+        self.add_item("response_cache_size", default=1000, des="Max Entries in Response Cache")
+        self.add_item("reranker_batch_size", default=32, des="Max Batch Size of Re-Ranker")
+        self.add_item("enable_rerank_batcher", default=False, des="Merge Re-Rank Jobs Across Requests")
+        self.add_item("rerank_batch_window_ms", default=5, des="Re-Rank Batching Window (ms)")
+        self.add_item("graph_batch_size", default=1000, des="Triples per Batch for Graph Ingestion")
+        self.add_item("graph_embed_batch_size", default=256, des="Entities per Batch for Graph Embedding")
+        self.add_item("graph_max_hops", default=3, des="Max Hops of Graph Expansion")
+        self.add_item("graph_hop_fanout", default=20, des="Max Neighbors per Node in Each Hop of Graph Expansion")
+        self.add_item("graph_max_edges", default=300, des="Max Edges Returned by Graph Expansion")
+        self.add_item("graph_rank_by", default="degree", des="Ranking of Neighbors in Graph Expansion", choices=["degree", "similarity"])
+        self.add_item("enable_graph_cache", default=False, des="Serve Graph Queries from an In-Memory Copy")
+        self.add_item("graph_relation_types", default=[], des="Relation Types Followed by Graph Expansion, Empty for All")
 
         self.filename = filename or os.path.join(self.save_dir, "config", "config.yaml")
         os.makedirs(os.path.dirname(self.filename), exist_ok=True)
@@ -0,0 +1,130 @@
+"""
+Recall / latency benchmark of the ANN search profiles of a Milvus collection.
+
+Stored vectors of the collection are sampled as queries, the exact top-k computed
+by brute force over the whole collection (scanned batch by batch) is used as ground truth.
+
+    python -m src.core.benchmark --collection <metaname> --k 10 --queries 100
+"""
+import os
+import time
+import random
+from argparse import ArgumentParser
+
+import numpy as np
+from pymilvus import MilvusClient
+
+from src.common import setup_logger
+from src.core.knowledgebase import SEARCH_PROFILES
+
+logger = setup_logger("Benchmark")
+
+MAX_VECTORS = 16384
+
+
+def load_vectors(client, collection_name, max_vectors=MAX_VECTORS):
+    """The first `max_vectors` vectors of the collection, the pool the queries are sampled from"""
+    ids, vectors = [], []
+    iterator = client.query_iterator(collection_name, batch_size=1000, output_fields=["id", "vector"])
+    while len(ids) < max_vectors:
+        batch = iterator.next()
+        if not batch:
+            break
+        ids.extend(row["id"] for row in batch)
+        vectors.extend(row["vector"] for row in batch)
+    iterator.close()
+    return np.asarray(ids[:max_vectors]), np.asarray(vectors[:max_vectors], dtype=np.float32)
+
+
+def similarity(queries, vectors, metric_type):
+    """Scores of `vectors` for every query, higher is closer"""
+    if metric_type == "L2":
+        return 2 * queries @ vectors.T - (vectors ** 2).sum(1)[None, :]
+    if metric_type == "COSINE":
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True).clip(1e-12)
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True).clip(1e-12)
+    return queries @ vectors.T
+
+
+def exact_topk(client, collection_name, queries, k, metric_type, batch_size=1000):
+    """Ids of the exact top-k of every query over the whole collection,
+    only the running top-k and one batch of vectors are held in memory"""
+    top_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    top_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    iterator = client.query_iterator(collection_name, batch_size=batch_size, output_fields=["id", "vector"])
+    try:
+        while batch := iterator.next():
+            ids = np.asarray([row["id"] for row in batch], dtype=np.int64)
+            vectors = np.asarray([row["vector"] for row in batch], dtype=np.float32)
+            scores = np.concatenate([top_scores, similarity(queries, vectors, metric_type)], axis=1)
+            ids = np.concatenate([top_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+            order = np.argsort(-scores, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, order, axis=1)
+            top_ids = np.take_along_axis(ids, order, axis=1)
+    finally:
+        iterator.close()
+    return top_ids
+
+
+def describe_index(client, collection_name):
+    for field_name in ["vector"]:
+        for index_name in client.list_indexes(collection_name, field_name=field_name):
+            info = client.describe_index(collection_name, index_name)
+            return info.get("index_type"), info.get("metric_type")
+    return None, None
+
+
+def run(collection_name, k=10, num_queries=100, profiles=None, uri=None):
+    uri = uri or os.getenv("MILVUS_URI", "http://milvus:19530")
+    client = MilvusClient(uri=uri)
+    client.load_collection(collection_name)
+    index_type, metric_type = describe_index(client, collection_name)
+    metric_type = metric_type or "COSINE"
+    logger.info(f"{collection_name}: index={index_type}, metric={metric_type}")
+
+    ids, vectors = load_vectors(client, collection_name)
+    if len(ids) == 0:
+        raise ValueError(f"Collection {collection_name} is empty")
+
+    sample = random.sample(range(len(ids)), min(num_queries, len(ids)))
+    queries = vectors[sample]
+    truth = [set(row.tolist()) for row in exact_topk(client, collection_name, queries, k, metric_type)]
+
+    results = {}
+    for profile in profiles or list(SEARCH_PROFILES):
+        params = SEARCH_PROFILES[profile].get(index_type, {})
+        if "ef" in params:
+            params = {**params, "ef": max(params["ef"], k)}
+        search_params = {"metric_type": metric_type, "params": params}
+
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            res = client.search(collection_name, data=[query.tolist()], limit=k,
+                                search_params=search_params, output_fields=["id"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            found = {hit["id"] for hit in res[0]}
+            recalls.append(len(found & expected) / len(expected))
+
+        results[profile] = {
+            "params": params,
+            f"recall@{k}": float(np.mean(recalls)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
+        logger.info(f"{profile:>8}: {params}, recall@{k}={results[profile][f'recall@{k}']:.4f}, "
+                    f"p50={results[profile]['p50_ms']:.2f}ms, p95={results[profile]['p95_ms']:.2f}ms")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--collection', type=str, required=True, help='Metaname of the knowledge base')
+    parser.add_argument('--k', type=int, default=10, help='Number of neighbors')
+    parser.add_argument('--queries', type=int, default=100, help='Number of sampled queries')
+    parser.add_argument('--profiles', type=str, nargs='+', choices=list(SEARCH_PROFILES), default=None)
+    parser.add_argument('--uri', type=str, default=None, help='Milvus uri, defaults to MILVUS_URI')
+    args = parser.parse_args()
+
+    run(args.collection, k=args.k, num_queries=args.queries, profiles=args.profiles, uri=args.uri)
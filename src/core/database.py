@@ -1,6 +1,9 @@
 import os
 import json
 import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
 
 from pathlib import Path
 from typing import List, Tuple, Dict, Union
@@ -9,6 +12,7 @@ from src.plugins import pdf2txt
 from src.common import setup_logger, hashstr, is_text_pdf
 from src.models import get_embedding_model
 from src.config import Config
+from src.core.jobs import JobManager
 
 logger = setup_logger("DataBaseManager")
 
@@ -36,10 +40,20 @@ class DataBaseManager:
                 self.graph_base = None
 
         self.data = {"databases": [], "graph": {}}
+        self.save_lock = threading.Lock()
+        self.write_cond = threading.Condition()
+        self.migrating = set()   # db_id of the databases being migrated
+        self.writers = Counter() # db_id -> running jobs writing to its collection
 
         self._load_databases()
         self._update_database()
 
+        self.jobs = JobManager(os.path.join(config.save_dir, "data", "jobs.json"),
+                               workers=int(config.ingest_workers or 2))
+        self.jobs.register("add_files", self._ingest_files)
+        self.jobs.register("upsert_file", self._upsert_file)
+        self.jobs.register("migrate_collection", self._migrate_collection)
+
     def _load_databases(self):
         """将数据库的信息保存到本地的文件里面"""
         if not os.path.exists(self.database_path):
@@ -62,7 +76,7 @@ class DataBaseManager:
         """将数据库的信息保存到本地的文件里面"""
         self._update_database()
         os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
-        with open(self.database_path, "w+") as f:
+        with self.save_lock, open(self.database_path, "w+") as f:
             json.dump({
                 "databases": [db.to_dict() for db in self.data["databases"]],
                 "graph": self.data["graph"]
@@ -100,7 +114,9 @@ class DataBaseManager:
                                     description,
                                     db_type,
                                     embed_model=self.config.embed_model,
-                                    dimension=dimension)
+                                    dimension=dimension,
+                                    index_type=self.config.vector_index_type or "HNSW",
+                                    metric_type=self.config.vector_metric_type or "COSINE")
 
         self.knowledge_base.add_collection(new_database.metaname, dimension)
         self.data["databases"].append(new_database)
@@ -108,15 +124,18 @@ class DataBaseManager:
         return self.get_databases()
 
     def add_files(self, db_id, files, params=None):
+        """将文件加入解析队列，立即返回任务 id，解析进度通过 self.jobs 查询"""
         db = self.get_kb_by_id(db_id)
+        if db_id in self.migrating:
+            return {"message": "数据库迁移中，请稍后再试", "status": "failed"}
 
         if db.embed_model != self.config.embed_model:
             logger.error(f"Embed model not match, {db.embed_model} != {self.config.embed_model}")
             return {"message": f"Embed model not match, cur: {self.config.embed_model}", "status": "failed"}
 
-        # Preprocessing the files to the queue
+        # Preprocessing the files to the queue, directories are expanded to the supported files in them
         new_files = []
-        for file in files:
+        for file in self._expand_files(files):
             new_file = {
                 "file_id": "file_" + hashstr(file + str(time.time())),
                 "filename": os.path.basename(file),
@@ -128,76 +147,226 @@ class DataBaseManager:
             db.files.append(new_file)
             new_files.append(new_file)
 
-        from src.common.chunker import chunk
-        for new_file in new_files:
-            file_id = new_file["file_id"]
-            idx = self.get_idx_by_fileid(db, file_id)
-            db.files[idx]["status"] = "processing"
+        self._save_databases()
+        job = self.jobs.submit("add_files", {"db_id": db_id, "params": self._parse_params(params)}, files=new_files)
+        return {"message": "已加入解析队列", "status": "queued", "job_id": job["job_id"]}
 
-            try:
-                if new_file["type"] == "pdf":
-                    texts = self.read_text(new_file["path"])
-                    nodes = chunk(texts, params=params)
-                else:
-                    nodes = chunk(new_file["path"], params=params)
+    def _ingest_files(self, job):
+        """后台任务：通过流水线并行解析、分块、向量化并插入任务中的文件"""
+        job_id = job["job_id"]
+        db = self.get_kb_by_id(job["payload"]["db_id"])
+        if db is None:
+            raise ValueError(f"Database {job['payload']['db_id']} not found")
 
-                self.knowledge_base.add_documents(
-                    docs=[node.text for node in nodes],
-                    collection_name=db.metaname,
-                    file_id=file_id)
+        # waits while the collection is being migrated
+        with self._writing(db.db_id):
+            files = []
+            for file_id, file_state in job["files"].items():
+                if file_state["status"] in ["done", "failed"]:
+                    continue
 
                 idx = self.get_idx_by_fileid(db, file_id)
-                db.files[idx]["status"] = "done"
+                if idx is None:
+                    self.jobs.update_file(job_id, file_id, status="failed", persist=True)
+                    continue
 
-            except Exception as e:
-                logger.error(f"Failed to add documents to collection {db.metaname}, {e}")
-                idx = self.get_idx_by_fileid(db, file_id)
-                db.files[idx]["status"] = "failed"
+                if file_state["status"] == "processing":
+                    # drop the chunks inserted before the job was interrupted
+                    self.knowledge_base.client.delete(
+                        collection_name=db.metaname,
+                        filter=f"file_id == '{file_id}'")
 
-            self._save_databases()
+                db.files[idx]["status"] = "processing"
+                self.jobs.update_file(job_id, file_id, status="processing", persist=True)
+                files.append(db.files[idx])
 
-        return {"message": "全部解析完成", "status": "success"}
+            def progress(file_id, stage, current=None, total=None):
+                self.jobs.update_file(job_id, file_id, stage=stage, current=current, total=total)
 
-    def get_database_info(self, db_id):
+            def on_done(file_id, status):
+                db.id2file(file_id)["status"] = status
+                self.jobs.update_file(job_id, file_id, status=status, stage=None, persist=True)
+
+            from src.core.pipeline import IngestionPipeline
+            try:
+                IngestionPipeline(self.knowledge_base, self.config).run(
+                    db.metaname, files,
+                    params=job["payload"].get("params"),
+                    progress=progress,
+                    on_done=on_done)
+            finally:
+                # 流水线异常退出时也保存失败的文件状态，避免重启后显示为处理中
+                self._save_databases()
+
+    def upsert_file(self, db_id, file_id, file, params=None):
+        """用新版本的文件更新已有文件，只向量化并插入变化的分块，删除已移除的分块"""
         db = self.get_kb_by_id(db_id)
         if db is None:
-            return None
-        else:
-            db.update(self.knowledge_base.get_collection_info(db.metaname))
-            return db.to_dict()
+            return {"message": "database not found", "status": "failed"}
+        if db_id in self.migrating:
+            return {"message": "数据库迁移中，请稍后再试", "status": "failed"}
 
-    def read_text(self, file, params=None):
-        support_format = [".pdf", ".txt", ".md"]
-        assert os.path.exists(file), "File not found"
-        logger.info(f"Try to read file {file}")
+        if db.embed_model != self.config.embed_model:
+            logger.error(f"Embed model not match, {db.embed_model} != {self.config.embed_model}")
+            return {"message": f"Embed model not match, cur: {self.config.embed_model}", "status": "failed"}
 
-        if not os.path.isfile(file):
-            logger.error(f"Directory not supported now!")
-            raise NotImplementedError("Directory not supported now!")
+        record = db.id2file(file_id)
+        if record is None:
+            return {"message": f"file {file_id} not found", "status": "failed"}
 
-        if file.endswith(".pdf"):
-            if is_text_pdf(file):
-                from src.core.reader import pdfreader
-                return pdfreader(file)
-            else:
-                from src.plugins import pdf2txt
-                return pdf2txt(file, return_text=True)
+        record.update({
+            "filename": os.path.basename(file),
+            "path": file,
+            "type": file.split(".")[-1].lower(),
+            "status": "waiting",
+            "updated_at": time.time()
+        })
+
+        self._save_databases()
+        job = self.jobs.submit("upsert_file", {"db_id": db_id, "params": self._parse_params(params)}, files=[record])
+        return {"message": "已加入解析队列", "status": "queued", "job_id": job["job_id"]}
+
+    def _parse_params(self, params=None):
+        """解析参数，未指定 chunk_method 时使用配置中的默认分块方式"""
+        return {"chunk_method": self.config.chunk_method or "sentence", **(params or {})}
+
+    def _upsert_file(self, job):
+        """后台任务：解析新版本文件，并按内容哈希与已有分块做增量同步"""
+        job_id = job["job_id"]
+        db = self.get_kb_by_id(job["payload"]["db_id"])
+        if db is None:
+            raise ValueError(f"Database {job['payload']['db_id']} not found")
+
+        # waits while the collection is being migrated
+        with self._writing(db.db_id):
+            from src.common.parsing import parse_file
+            for file_id in job["files"]:
+                record = db.id2file(file_id)
+                if record is None:
+                    self.jobs.update_file(job_id, file_id, status="failed", persist=True)
+                    continue
+
+                record["status"] = "processing"
+                self.jobs.update_file(job_id, file_id, status="processing", persist=True)
+                progress = self.jobs.progress_callback(job_id, file_id)
+
+                try:
+                    docs = parse_file(record["path"], record["type"], job["payload"].get("params"), progress=progress)
+                    result = self.knowledge_base.upsert_documents(docs, db.metaname, file_id, progress=progress)
+                    self.jobs.update(job_id, result=result)
+                    record["status"] = "done"
+                except Exception as e:
+                    logger.error(f"Failed to upsert {file_id} in collection {db.metaname}, {e}")
+                    record["status"] = "failed"
+
+                self.jobs.update_file(job_id, file_id, status=record["status"], stage=None, persist=True)
 
-        elif file.endswith(".txt") or file.endswith(".md"):
-            from src.core.reader import plainreader
-            return plainreader(file)
+        self._save_databases()
+
+    def set_search_profile(self, db_id, search_profile):
+        from src.core.knowledgebase import SEARCH_PROFILES
+        db = self.get_kb_by_id(db_id)
+        if db is None:
+            return {"message": "database not found", "status": "failed"}
+        if search_profile not in SEARCH_PROFILES:
+            return {"message": f"unknown search profile, only support {list(SEARCH_PROFILES)}", "status": "failed"}
+
+        db.search_profile = search_profile
+        if db.index_type is None or db.metric_type is None:
+            # 旧数据库没有记录索引类型与度量方式，从 Milvus 中的向量索引读取
+            db.index_type, db.metric_type = self.knowledge_base.describe_vector_index(db.metaname)
+        self._save_databases()
+        return {"message": "success", "status": "success", "search_profile": search_profile}
+
+    def migrate_database(self, db_id=None):
+        """将旧的（quick setup 创建的）集合迁移到显式 schema，db_id 为空时迁移所有旧集合"""
+        dbs = [self.get_kb_by_id(db_id)] if db_id else self.data["databases"]
+        if None in dbs:
+            return {"message": "database not found", "status": "failed"}
 
+        for db in dbs:
+            self.knowledge_base.recover_migration(db.metaname)
+        db_ids = [db.db_id for db in dbs if not self.knowledge_base.has_explicit_schema(db.metaname)]
+        if not db_ids:
+            return {"message": "无需迁移", "status": "success"}
+
+        job = self.jobs.submit("migrate_collection", {"db_ids": db_ids})
+        return {"message": "已加入迁移队列", "status": "queued", "job_id": job["job_id"]}
+
+    def _migrate_collection(self, job):
+        from src.config import EMBED_MODEL_INFO
+        for db_id in job["payload"]["db_ids"]:
+            db = self.get_kb_by_id(db_id)
+            if db is None:
+                continue
+            dimension = db.dimension or EMBED_MODEL_INFO[db.embed_model]["dimension"]
+            with self._migrating(db_id):
+                migrated = self.knowledge_base.migrate_collection(
+                    db.metaname, dimension, batch_size=int(self.config.insert_batch_size or 1000))
+            if migrated:
+                db.index_type = self.config.vector_index_type or "HNSW"
+                db.metric_type = self.config.vector_metric_type or "COSINE"
+        self._save_databases()
+
+    @contextmanager
+    def _writing(self, db_id):
+        """写入集合的任务在迁移期间等待，迁移开始前等待已有的写入任务结束"""
+        with self.write_cond:
+            self.write_cond.wait_for(lambda: db_id not in self.migrating)
+            self.writers[db_id] += 1
+        try:
+            yield
+        finally:
+            with self.write_cond:
+                self.writers[db_id] -= 1
+                self.write_cond.notify_all()
+
+    @contextmanager
+    def _migrating(self, db_id):
+        """迁移期间拒绝新的写入请求，并阻塞已排队的写入任务"""
+        with self.write_cond:
+            self.migrating.add(db_id)
+            self.write_cond.wait_for(lambda: self.writers[db_id] == 0)
+        try:
+            yield
+        finally:
+            with self.write_cond:
+                self.migrating.discard(db_id)
+                self.write_cond.notify_all()
+
+    def _expand_files(self, files):
+        support_format = [".pdf", ".txt", ".md"]
+        for file in files:
+            if os.path.isdir(file):
+                for root, _, names in os.walk(file):
+                    for name in sorted(names):
+                        if os.path.splitext(name)[1].lower() in support_format:
+                            yield os.path.join(root, name)
+            else:
+                yield file
+
+    def get_database_info(self, db_id):
+        db = self.get_kb_by_id(db_id)
+        if db is None:
+            return None
         else:
-            logger.error(f"File format not supported, only support {support_format}")
-            raise Exception(f"File format not supported, only support {support_format}")
+            db.update(self.knowledge_base.get_collection_info(db.metaname))
+            return db.to_dict()
+
+    def read_text(self, file, params=None, progress=None):
+        from src.common.reader import read_text
+        return read_text(file, progress=progress)
 
     def delete_file(self, db_id, file_id):
         db = self.get_kb_by_id(db_id)
+        if db_id in self.migrating:
+            return {"message": "数据库迁移中，请稍后再试", "status": "failed"}
         file_idx_to_delete = self.get_idx_by_fileid(db, file_id)
 
-        self.knowledge_base.client.delete(
-            collection_name=db.metaname,
-            filter=f"file_id == '{file_id}'"),
+        with self._writing(db_id):
+            self.knowledge_base.client.delete(
+                collection_name=db.metaname,
+                filter=f"file_id == '{file_id}'"),
 
         del db.files[file_idx_to_delete]
         self._save_databases()
@@ -256,6 +425,9 @@ class DataBaseLite:
         self.metadata = kwargs.get("metadata", {})
         self.files = kwargs.get("files", [])
         self.embed_model = kwargs.get("embed_model", None)
+        self.index_type = kwargs.get("index_type", None)
+        self.metric_type = kwargs.get("metric_type", None)
+        self.search_profile = kwargs.get("search_profile", "balanced")
 
     def id2file(self, file_id):
         for f in self.files:
@@ -276,7 +448,10 @@ class DataBaseLite:
             "metaname": self.metaname,
             "metadata": self.metadata,
             "files": self.files,
-            "dimension": self.dimension
+            "dimension": self.dimension,
+            "index_type": self.index_type,
+            "metric_type": self.metric_type,
+            "search_profile": self.search_profile
         }
 
     def to_json(self):
@@ -0,0 +1,258 @@
+import time
+import threading
+import numpy as np
+from collections import defaultdict
+from typing import List, Dict, Any
+
+from src.common import setup_logger
+
+logger = setup_logger("GraphCache")
+
+
+class GraphCache:
+
+    """ In-process copy of the knowledge graph for hot lookups
+    - nodes are interned to dense ids, the adjacency is kept as CSR arrays;
+    - the normalized entity embeddings form a matrix searched by brute force;
+    - mutations mark the arrays dirty, they are rebuilt on the next query.
+    Results use the Neo4j element ids, so they match the ones of the Cypher queries.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.ids = []                       # idx -> element id
+            self.names = []                     # idx -> name
+            self.alive = []                     # idx -> not deleted
+            self.id2idx = {}                    # element id -> idx
+            self.name2idx = defaultdict(list)   # name -> [idx]
+            self.vectors = {}                   # idx -> normalized embedding
+            self.edges = {}                     # edge id -> (source idx, target idx, type)
+            self.incident = defaultdict(set)    # idx -> edge ids
+            self.dirty = True
+
+    ####################
+    #       sync       #
+    ####################
+
+    def load(self, driver):
+        """Load all the nodes and relationships of the graph"""
+        start = time.time()
+
+        def read(tx):
+            nodes = tx.run("MATCH (n) RETURN elementId(n) AS id, n.name AS name, n.embedding AS embedding").data()
+            edges = tx.run("""
+            MATCH (a)-[r]->(b)
+            RETURN elementId(r) AS id, elementId(a) AS source, elementId(b) AS target, coalesce(r.type, type(r)) AS type
+            """).data()
+            return nodes, edges
+
+        with driver.session() as session:
+            nodes, edges = session.execute_read(read)
+
+        with self.lock:
+            self.clear()
+            for node in nodes:
+                self.upsert_node(node["id"], node["name"], node["embedding"])
+            for edge in edges:
+                self.upsert_edge(edge["id"], edge["source"], edge["target"], edge["type"])
+            self._build()
+            self.loaded = True
+
+        logger.info(f"Loaded {len(nodes)} nodes and {len(edges)} edges into graph cache in {time.time() - start:.2f}s")
+
+    def sync_entities(self, driver, names: List[str], batch_size: int = 1000):
+        """Reload the entities named `names` and their relationships from Neo4j"""
+        def read(tx, names):
+            return tx.run("""
+            UNWIND $names AS name
+            MATCH (n:Entity {name: name})
+            OPTIONAL MATCH (n)-[r]-(m)
+            RETURN elementId(n) AS id, n.name AS name, n.embedding AS embedding,
+                   collect(CASE WHEN r IS NULL THEN NULL ELSE {
+                       id: elementId(r), type: coalesce(r.type, type(r)),
+                       source: elementId(startNode(r)), target: elementId(endNode(r)),
+                       other_id: elementId(m), other_name: m.name
+                   } END) AS edges
+            """, names=names).data()
+
+        names = list(dict.fromkeys(names))
+        with driver.session() as session:
+            for i in range(0, len(names), batch_size):
+                rows = session.execute_read(read, names[i:i + batch_size])
+                with self.lock:
+                    for row in rows:
+                        self.upsert_node(row["id"], row["name"], row["embedding"])
+                        for edge in row["edges"]:
+                            self.upsert_node(edge["other_id"], edge["other_name"])
+                            self.upsert_edge(edge["id"], edge["source"], edge["target"], edge["type"])
+
+    def upsert_node(self, element_id, name, embedding=None):
+        with self.lock:
+            idx = self.id2idx.get(element_id)
+            if idx is None:
+                idx = len(self.ids)
+                self.ids.append(element_id)
+                self.names.append(name)
+                self.alive.append(True)
+                self.id2idx[element_id] = idx
+                self.name2idx[name].append(idx)
+            if embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32)
+                self.vectors[idx] = vector / (np.linalg.norm(vector) or 1.0)
+            self.dirty = True
+            return idx
+
+    def upsert_edge(self, edge_id, source_id, target_id, edge_type):
+        with self.lock:
+            source, target = self.id2idx[source_id], self.id2idx[target_id]
+            self.edges[edge_id] = (source, target, edge_type)
+            self.incident[source].add(edge_id)
+            self.incident[target].add(edge_id)
+            self.dirty = True
+
+    def remove_entity(self, name):
+        with self.lock:
+            for idx in self.name2idx.pop(name, []):
+                self.alive[idx] = False
+                self.vectors.pop(idx, None)
+                for edge_id in self.incident.pop(idx, set()):
+                    source, target, _ = self.edges.pop(edge_id, (None, None, None))
+                    for other in (source, target):
+                        if other is not None and other != idx:
+                            self.incident[other].discard(edge_id)
+            self.dirty = True
+
+    def _build(self):
+        """Rebuild the CSR adjacency (outgoing edges) and the embedding matrix"""
+        num_nodes = len(self.ids)
+        edge_ids = list(self.edges)
+        sources = np.fromiter((self.edges[e][0] for e in edge_ids), dtype=np.int64, count=len(edge_ids))
+        targets = np.fromiter((self.edges[e][1] for e in edge_ids), dtype=np.int64, count=len(edge_ids))
+
+        order = np.argsort(sources, kind="stable")
+        self.edge_ids = [edge_ids[i] for i in order]
+        self.targets = targets[order]
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_nodes), out=self.indptr[1:])
+        self.degree = np.bincount(sources, minlength=num_nodes) + np.bincount(targets, minlength=num_nodes)
+
+        self.vector_idx = np.fromiter(self.vectors, dtype=np.int64, count=len(self.vectors))
+        dim = len(next(iter(self.vectors.values()))) if self.vectors else 0
+        self.matrix = np.stack(list(self.vectors.values())) if self.vectors else np.zeros((0, dim), dtype=np.float32)
+        self.dirty = False
+
+    ####################
+    #      query       #
+    ####################
+
+    def search(self, embeddings, num_of_res=5, threshold=0.9) -> List[int]:
+        """Top `num_of_res` entities of each embedding with a score above `threshold`.
+        Scores are on the scale of the Neo4j vector index, (1 + cosine) / 2, so the same
+        threshold selects the same seeds as `db.index.vector.queryNodes` in the Cypher queries."""
+        if num_of_res <= 0 or len(embeddings) == 0:
+            return []
+
+        with self.lock:
+            if self.dirty:
+                self._build()
+            if len(self.vector_idx) == 0:
+                return []
+
+            queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True).clip(1e-12)
+            scores = (1 + queries @ self.matrix.T) / 2
+            k = min(num_of_res, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+            seeds = []
+            for row, cols in enumerate(top):
+                for col in cols[np.argsort(-scores[row, cols])]:
+                    if scores[row, col] > threshold:
+                        seeds.append(int(self.vector_idx[col]))
+            return list(dict.fromkeys(seeds))
+
+    def find(self, name) -> List[int]:
+        with self.lock:
+            return list(self.name2idx.get(name, []))
+
+    def expand(
+        self,
+        seeds: List[int],
+        hops: int = 2,
+        fanout: int = 20,
+        budget: int = 300,
+        rel_types: List[str] = None,
+        rank_by: str = "degree",
+        query_embedding = None
+        ) -> Dict[str, List[Dict[str, Any]]]:
+        """Same expansion as `GraphDB._expand_subgraph`, served from the CSR arrays.
+        Like the `(n)-[r]->(m)` pattern of the Cypher query, only outgoing edges are followed:
+        the CSR is indexed by source node, incoming edges of a node are not expanded."""
+        with self.lock:
+            if self.dirty:
+                self._build()
+
+            query = None
+            if rank_by == "similarity" and query_embedding is not None:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+
+            def rank(idx):
+                if query is not None:
+                    vector = self.vectors.get(idx)
+                    return float(vector @ query) if vector is not None else 0.0
+                return int(self.degree[idx])
+
+            visited = set(seeds)
+            frontier = list(seeds)
+            edges = []
+            for _ in range(int(hops)):
+                hop_nodes = []
+                for node in frontier:
+                    start, end = self.indptr[node], self.indptr[node + 1]
+                    candidates = [(self.edge_ids[i], int(self.targets[i])) for i in range(start, end)]
+                    if rel_types:
+                        candidates = [(e, m) for e, m in candidates if self.edges[e][2] in rel_types]
+                    candidates.sort(key=lambda c: rank(c[1]), reverse=True)
+                    for edge_id, neighbor in candidates[:fanout]:
+                        edges.append(edge_id)
+                        hop_nodes.append(neighbor)
+
+                frontier = [m for m in dict.fromkeys(hop_nodes) if m not in visited]
+                visited.update(frontier)
+                frontier = frontier[:budget]
+                if not frontier or len(edges) >= budget:
+                    break
+
+            return self._format(seeds, list(dict.fromkeys(edges))[:budget])
+
+    def _format(self, seeds, edge_ids):
+        nodes = {self.ids[idx]: {"id": self.ids[idx], "name": self.names[idx]} for idx in seeds}
+        edges = []
+        for edge_id in edge_ids:
+            source, target, edge_type = self.edges[edge_id]
+            edges.append({
+                "id": edge_id,
+                "type": edge_type,
+                "source_id": self.ids[source],
+                "source_name": self.names[source],
+                "target_id": self.ids[target],
+                "target_name": self.names[target],
+            })
+            for idx in (source, target):
+                nodes.setdefault(self.ids[idx], {"id": self.ids[idx], "name": self.names[idx]})
+        return {"nodes": list(nodes.values()), "edges": edges}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "loaded": self.loaded,
+                "nodes": sum(self.alive),
+                "edges": len(self.edges),
+                "embeddings": len(self.vectors),
+            }
@@ -1,6 +1,10 @@
 import os
+import re
 import json
+import time
 import torch
+import threading
+import numpy as np
 
 from neo4j import GraphDatabase
 from typing import List, Dict, Tuple, Any
@@ -19,6 +23,51 @@ logger = setup_logger("Graph Database")
 
 UIE_MODEL = None
 
+# constraints and indexes created by `GraphDB.ensure_schema`, the uniqueness constraint
+# is backed by a range index used by every `MERGE` / `MATCH (n:Entity {name: ...})`
+GRAPH_SCHEMA = [
+    "CREATE CONSTRAINT entity_name IF NOT EXISTS FOR (n:Entity) REQUIRE n.name IS UNIQUE",
+    "CREATE TEXT INDEX entity_name_text IF NOT EXISTS FOR (n:Entity) ON (n.name)",
+]
+
+def _to_list(vector):
+    return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+def iter_json_array(file_path, chunk_size=1 << 16):
+    """Yield the items of a top-level JSON array one by one, reading `chunk_size` chars at a time"""
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        buffer, pos = f.read(chunk_size), 0
+        eof = False
+
+        def skip(chars):
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in chars):
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+
+        skip("")
+        assert buffer[pos:pos + 1] == "[", f"{file_path} is not a JSON array"
+        pos += 1
+        while True:
+            skip(",")
+            if pos >= len(buffer) or buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0  # the item spans the next chunk
+                continue
+            yield item
+            buffer, pos = buffer[end:], 0
+
 class GraphDB:
 
     def __init__(
@@ -36,6 +85,14 @@ class GraphDB:
 
         assert embed_model, "embed_model=None"
 
+        self.cache = None
+        self.cache_lock = threading.Lock()
+        self.cache_failures = 0   # consecutive failed loads of the cache
+        self.cache_retry_at = 0   # queries do not retry a failed load before this time
+        if self.config.enable_graph_cache:
+            from src.core.graph_cache import GraphCache
+            self.cache = GraphCache()
+
     ####################
     #      basic       #
     ####################
@@ -54,11 +111,54 @@ class GraphDB:
                 auth=(username, password)
             )
             self.status = "open"
+            self.ensure_schema()
             logger.info(f"Connected to Neo4j at {uri}/{self.kgdb_name}, {self.get_database_info()}")
+            self.load_cache()
         except Exception as e:
             logger.error(f"Failed to connect to Neo4j: {e}, {uri}, {self.kgdb_name}, {username}, {password}")
             self.config.enable_knowledge_graph = False
 
+    """
+    Create the constraints, the text index and the vector index of the entities if they do not exist
+    """
+    def ensure_schema(self):
+        from src.config import EMBED_MODEL_INFO
+        with self.driver.session() as session:
+            for statement in GRAPH_SCHEMA:
+                try:
+                    session.run(statement).consume()
+                except Exception as e:
+                    logger.error(f"Failed to run `{statement}`: {e}")
+
+            dimension = EMBED_MODEL_INFO[self.config.embed_model].get('dimension')
+            session.execute_write(self._create_vector_index, dimension)
+
+    def load_cache(self):
+        """(Re)load the graph cache, after a failure queries are served by Cypher and retry
+        the load with an exponential backoff (30s doubling up to 30min)"""
+        if self.cache is None:
+            return
+        with self.cache_lock:
+            try:
+                self.cache.load(self.driver)
+                self.cache_failures = 0
+            except Exception as e:
+                self.cache_failures += 1
+                delay = min(30 * 2 ** (self.cache_failures - 1), 1800)
+                self.cache_retry_at = time.time() + delay
+                logger.error(f"Failed to load graph cache: {e}, use Cypher queries and retry in {delay}s")
+
+    def _cache_ready(self):
+        if self.cache is None:
+            return False
+        if not self.cache.loaded and time.time() >= self.cache_retry_at and not self.cache_lock.locked():
+            self.load_cache()
+        return self.cache.loaded
+
+    def _sync_cache(self, names):
+        if self.cache is not None and self.cache.loaded:
+            self.cache.sync_entities(self.driver, names, batch_size=int(self.config.graph_batch_size or 1000))
+
     """
     Close the connection to the knowledge graph
     """
@@ -112,13 +212,25 @@ class GraphDB:
             # access all labels
             labels = tx.run("CALL db.labels() YIELD label RETURN collect(label) AS labels").single()["labels"]
 
+            indexes = tx.run("""
+            SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, state, populationPercent
+            RETURN name, type, entityType, labelsOrTypes, properties, state, populationPercent
+            """).data()
+            constraints = tx.run("""
+            SHOW CONSTRAINTS YIELD name, type, labelsOrTypes, properties
+            RETURN name, type, labelsOrTypes, properties
+            """).data()
+
             return {
                 "database_name": db_name,
                 "entity_count": entity_count,
                 "relationship_count": relationship_count,
                 "triples_count": triples_count,
                 "labels": labels,
-                "status": self.status
+                "indexes": indexes,
+                "constraints": constraints,
+                "status": self.status,
+                "cache": self.cache.stats() if self.cache is not None else None
             }
 
         with self.driver.session() as session:
@@ -142,8 +254,8 @@ class GraphDB:
     ):
         inputs = [text]
         with torch.no_grad():
-            outputs = self.embed_model.encode(inputs)
-        embeddings = outputs[0] # Assuming the average is taken as the embedding vector for the text.
+            outputs = self.embed_model.encode_cached(inputs)
+        embeddings = _to_list(outputs[0]) # Assuming the average is taken as the embedding vector for the text.
         return embeddings
 
     def set_embedding(
@@ -157,6 +269,17 @@ class GraphDB:
         CALL db.create.setNodeVectorProperty(e, 'embedding', $embedding)
         """, name=entity_name, embedding=embedding)
 
+    def set_embeddings(
+        self, 
+        tx, # a transaction object of neo4j
+        rows: List[Dict[str, Any]] # [{'name': 'entity name', 'embedding': [...]}]
+        ):
+        tx.run("""
+        UNWIND $rows AS row
+        MATCH (e:Entity {name: row.name})
+        CALL db.create.setNodeVectorProperty(e, 'embedding', row.embedding)
+        """, rows=[{"name": row["name"], "embedding": _to_list(row["embedding"])} for row in rows])
+
 
     ####################
     #       add        #
@@ -181,6 +304,8 @@ class GraphDB:
 
         with self.driver.session() as session:
             session.execute_write(create, triples)
+
+        self._sync_cache([name for triple in triples for name in (triple['h'], triple['t'])])
     
     """
     Auto add triples to the knowledge graph from pdf using OneKE
@@ -201,69 +326,138 @@ class GraphDB:
         self.jsonl_file_add_entity(triples_path)
         return kgdb_name
 
+    def _index_exists(
+        self, 
+        tx,  # a transaction object of neo4j
+        index_name
+        ) -> bool:
+        result = tx.run("SHOW INDEXES")
+        for record in result:
+            if record["name"] == index_name:
+                return True
+        return False
+
+    def _create_vector_index(
+        self, 
+        tx, 
+        dim):
+        index_name = "entityEmbeddings"
+        if not self._index_exists(tx, index_name):
+            tx.run(f"""
+            CREATE VECTOR INDEX {index_name}
+            FOR (n: Entity) ON (n.embedding)
+            OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {dim},
+            `vector.similarity_function`: 'cosine'
+            }} }};
+            """)
+
     """
     Add triple data to the knowledge graph database 
     and create vector indexes for entities.
+    Triples are written in batches of `batch_size` through a single UNWIND/MERGE statement.
     """
     def txt_add_vector_entity(
         self, 
         triples: List[Dict[str, str]], # [{'h':'head entity','t':'tail entity','r':'relation'}]
-        kgdb_name='neo4j'
+        kgdb_name='neo4j',
+        batch_size: int = None
         ):
         
         self.use_database(kgdb_name)
-        def _index_exists(
-            tx,  # a transaction object of neo4j
-            index_name
-            ) -> bool:
-            result = tx.run("SHOW INDEXES")
-            for record in result:
-                if record["name"] == index_name:
-                    return True
-            return False
-        
+        batch_size = int(batch_size or self.config.graph_batch_size or 1000)
+
         def _create_graph(
             tx,
             data: List[Dict[str, str]]
             ):
-            for entry in data:
-                tx.run("""
-                MERGE (h:Entity {name: $h})
-                MERGE (t:Entity {name: $t})
-                MERGE (h)-[r:RELATION {type: $r}]->(t)
-                """, h=entry['h'], t=entry['t'], r=entry['r'])
-
-        def _create_vector_index(
-            tx, 
-            dim):
-            index_name = "entityEmbeddings"
-            if not _index_exists(tx, index_name):
-                tx.run(f"""
-                CREATE VECTOR INDEX {index_name}
-                FOR (n: Entity) ON (n.embedding)
-                OPTIONS {{indexConfig: {{
-                `vector.dimensions`: {dim},
-                `vector.similarity_function`: 'cosine'
-                }} }};
-                """)
+            tx.run("""
+            UNWIND $triples AS triple
+            MERGE (h:Entity {name: triple.h})
+            MERGE (t:Entity {name: triple.t})
+            MERGE (h)-[r:RELATION {type: triple.r}]->(t)
+            """, triples=data)
+
+        start = time.time()
+        self.ensure_schema()
+        with self.driver.session() as session:
+            for i in range(0, len(triples), batch_size):
+                batch = [{"h": t["h"], "t": t["t"], "r": t["r"]} for t in triples[i:i + batch_size]]
+                logger.info(f"Adding triples {i+1}-{i+len(batch)}/{len(triples)}")
+                session.execute_write(_create_graph, batch)
 
-        from src.config import EMBED_MODEL_INFO
-        embed_info = EMBED_MODEL_INFO[self.config.embed_model]
+        names = [name for t in triples for name in (t["h"], t["t"])]
+        self.add_entity_embeddings(names, kgdb_name)
+        self._sync_cache(names)
+
+        elapsed = max(time.time() - start, 1e-6)
+        logger.info(f"Imported {len(triples)} triples in {elapsed:.2f}s ({len(triples) / elapsed:.1f} triples/sec)")
+
+    """
+    Embed the unique entity names in large batches,
+    skipping the entities that already have an `embedding` property.
+    """
+    def add_entity_embeddings(
+        self, 
+        names: List[str], 
+        kgdb_name='neo4j', 
+        batch_size: int = None
+        ):
+
+        self.use_database(kgdb_name)
+        batch_size = int(batch_size or self.config.graph_embed_batch_size or 256)
+        names = list(dict.fromkeys(names))
+
+        def _missing_embeddings(tx, names):
+            result = tx.run("""
+            UNWIND $names AS name
+            MATCH (e:Entity {name: name})
+            WHERE e.embedding IS NULL
+            RETURN e.name AS name
+            """, names=names)
+            return [record["name"] for record in result]
+
+        start = time.time()
+        with self.driver.session() as session:
+            missing = session.execute_read(_missing_embeddings, names)
+            logger.info(f"Embedding {len(missing)} of {len(names)} unique entities")
+            for i in range(0, len(missing), batch_size):
+                batch = missing[i:i + batch_size]
+                with torch.no_grad():
+                    vectors = self.embed_model.encode(batch)
+                session.execute_write(self.set_embeddings, [{"name": n, "embedding": v} for n, v in zip(batch, vectors)])
+
+        logger.info(f"Embedded {len(missing)} entities in {time.time() - start:.2f}s")
+
+    """
+    Embed all the entities without an `embedding` property, `batch_size` names at a time
+    """
+    def add_missing_embeddings(self, kgdb_name='neo4j', batch_size: int = None):
+        self.use_database(kgdb_name)
+        batch_size = int(batch_size or self.config.graph_embed_batch_size or 256)
+
+        def _missing_embeddings(tx, limit):
+            result = tx.run("""
+            MATCH (e:Entity)
+            WHERE e.embedding IS NULL AND e.name IS NOT NULL
+            RETURN e.name AS name LIMIT $limit
+            """, limit=limit)
+            return [record["name"] for record in result]
+
+        start, total = time.time(), 0
         with self.driver.session() as session:
-            session.execute_write(_create_graph, triples)
-            session.execute_write(_create_vector_index, embed_info.get('dimension'))
-            for i, entry in enumerate(triples):
-                logger.info(f"Adding entity {i+1}/{len(triples)}")
-                embedding_h = self.get_embedding(entry['h'])
-                session.execute_write(self.set_embedding, entry['h'], embedding_h)
+            while batch := session.execute_read(_missing_embeddings, batch_size):
+                with torch.no_grad():
+                    vectors = self.embed_model.encode(batch)
+                session.execute_write(self.set_embeddings, [{"name": n, "embedding": v} for n, v in zip(batch, vectors)])
+                total += len(batch)
 
-                embedding_t = self.get_embedding(entry['t'])
-                session.execute_write(self.set_embedding, entry['t'], embedding_t)
+        logger.info(f"Embedded {total} entities in {time.time() - start:.2f}s")
 
     """
     Add triples to the knowledge graph from a jsonl file (recommanded)
     """
-    def jsonl_file_add_entity(self, file_path, kgdb_name='neo4j'):
+    def jsonl_file_add_entity(self, file_path, kgdb_name='neo4j', batch_size=None):
         self.status = "processing"
         kgdb_name = kgdb_name or 'neo4j'
         self.use_database(kgdb_name)  # switch to the specified database
@@ -275,11 +469,97 @@ class GraphDB:
 
         triples = list(read_triples(file_path))
 
-        self.txt_add_vector_entity(triples, kgdb_name)
+        self.txt_add_vector_entity(triples, kgdb_name, batch_size=batch_size)
 
         self.status = "open"
         return kgdb_name
 
+    """
+    Bulk load the structured node files (data/node/herbs.json, formulae.json).
+    Every record {id, attributes: {name, label, ...}, relations: [...]} becomes a node
+    labeled `Entity` and its own label with the attributes as properties, every relation
+    {"Formula": x, "Herb": y, "Relation": "HAS_HERB"} becomes (x:Formula)-[:HAS_HERB]->(y:Herb).
+    The file is parsed incrementally and written in batches of `batch_size` rows,
+    the uniqueness constraints are created before the first batch.
+    """
+    def json_file_add_nodes(self, file_path, kgdb_name='neo4j', batch_size=None):
+        self.status = "processing"
+        kgdb_name = kgdb_name or 'neo4j'
+        self.use_database(kgdb_name)
+        batch_size = int(batch_size or self.config.graph_batch_size or 1000)
+
+        node_batches = {}  # label -> [{"name", "props"}]
+        rel_batches = {}   # (source label, relation, target label) -> [{"source", "target"}]
+        counts = {"nodes": 0, "relations": 0}
+
+        def _check(name):
+            assert re.fullmatch(r"\w+", name), f"Invalid label or relation type: {name}"
+            return name
+
+        def _merge_nodes(tx, label, rows):
+            tx.run(f"""
+            UNWIND $rows AS row
+            MERGE (n:Entity {{name: row.name}})
+            SET n:`{label}`, n += row.props
+            """, rows=rows)
+
+        def _merge_relations(tx, key, rows):
+            source_label, relation, target_label = key
+            tx.run(f"""
+            UNWIND $rows AS row
+            MERGE (s:Entity {{name: row.source}})
+            SET s:`{source_label}`
+            MERGE (t:Entity {{name: row.target}})
+            SET t:`{target_label}`
+            MERGE (s)-[:`{relation}`]->(t)
+            """, rows=rows)
+
+        def _flush(session, force=False):
+            for label, rows in list(node_batches.items()):
+                if rows and (force or len(rows) >= batch_size):
+                    session.execute_write(_merge_nodes, label, rows)
+                    counts["nodes"] += len(rows)
+                    node_batches[label] = []
+            for key, rows in list(rel_batches.items()):
+                if rows and (force or len(rows) >= batch_size):
+                    session.execute_write(_merge_relations, key, rows)
+                    counts["relations"] += len(rows)
+                    rel_batches[key] = []
+
+        start = time.time()
+        self.ensure_schema()
+        with self.driver.session() as session:
+
+            for record in iter_json_array(file_path):
+                attributes = dict(record.get("attributes", {}))
+                label = _check(attributes.pop("label", "Entity"))
+                props = {k: v for k, v in attributes.items() if k != "name" and v not in (None, "", "NA", [])}
+                node_batches.setdefault(label, []).append({"name": attributes["name"], "props": props})
+
+                for relation in record.get("relations", []):
+                    relation = dict(relation)
+                    rel_type = _check(relation.pop("Relation"))
+                    if label not in relation or len(relation) != 2:
+                        logger.warning(f"Skip relation {relation} of {attributes['name']}")
+                        continue
+                    source = relation.pop(label)
+                    target_label, target = next(iter(relation.items()))
+                    key = (label, rel_type, _check(target_label))
+                    rel_batches.setdefault(key, []).append({"source": source, "target": target})
+
+                _flush(session)
+            _flush(session, force=True)
+
+        self.add_missing_embeddings(kgdb_name)
+        if self.cache is not None and self.cache.loaded:
+            self.load_cache()
+
+        self.status = "open"
+        elapsed = max(time.time() - start, 1e-6)
+        logger.info(f"Loaded {counts['nodes']} nodes and {counts['relations']} relations "
+                    f"from {file_path} in {elapsed:.2f}s")
+        return kgdb_name
+
     ####################
     #      delete      #
     ####################
@@ -296,9 +576,15 @@ class GraphDB:
             else:
                 session.execute_write(self._delete_all_entities)
 
+        if self.cache is not None:
+            if entity_name:
+                self.cache.remove_entity(entity_name)
+            else:
+                self.cache.clear()
+
     def _delete_specific_entity(self, tx, entity_name):
         query = """
-        MATCH (n {name: $entity_name})
+        MATCH (n:Entity {name: $entity_name})
         DETACH DELETE n
         """
         tx.run(query, entity_name=entity_name)
@@ -352,6 +638,91 @@ class GraphDB:
         with self.driver.session() as session:
             return session.execute_read(query, entity_name)
 
+    def _expand_defaults(self, hops=None, fanout=None, budget=None, rel_types=None, rank_by=None, **kwargs):
+        """Expansion options of a query, the hops / fan-out / edge budget asked for by the
+        client are capped by graph_max_hops / graph_hop_fanout / graph_max_edges"""
+        max_hops = int(self.config.graph_max_hops or 3)
+        max_fanout = int(self.config.graph_hop_fanout or 20)
+        max_edges = int(self.config.graph_max_edges or 300)
+        return {
+            "hops": max(0, min(int(hops if hops is not None else 2), max_hops)),
+            "fanout": max(1, min(int(fanout or max_fanout), max_fanout)),
+            "budget": max(1, min(int(budget or max_edges), max_edges)),
+            "rel_types": rel_types or self.config.graph_relation_types or None,
+            "rank_by": rank_by or self.config.graph_rank_by or "degree",
+        }
+
+    """
+    Bounded subgraph expansion shared by the query functions below.
+    Starting from `seeds` (a list of nodes bound by `seed_cypher`), every hop keeps at most
+    `fanout` outgoing neighbors per frontier node, ranked by degree or by similarity to
+    `query_embedding`, and never expands a node twice. At most `budget` edges are returned,
+    deduplicated in Neo4j, so the size of the result does not depend on the degree of hub nodes.
+    """
+    def _expand_subgraph(
+        self, 
+        tx, # a transaction object of neo4j
+        seed_cypher: str, 
+        params: Dict[str, Any], 
+        hops: int = 2, 
+        fanout: int = None, 
+        budget: int = None, 
+        rel_types: List[str] = None, 
+        rank_by: str = None, 
+        query_embedding: List[float] = None
+        ) -> Dict[str, List[Dict[str, Any]]]:
+
+        options = self._expand_defaults(hops, fanout, budget, rel_types, rank_by)
+        hops, fanout, budget = options["hops"], options["fanout"], options["budget"]
+        rel_types, rank_by = options["rel_types"], options["rank_by"]
+
+        rel_filter = "WHERE coalesce(r.type, type(r)) IN $rel_types" if rel_types else ""
+        if rank_by == "similarity" and query_embedding is not None:
+            rank = "coalesce(vector.similarity.cosine(m.embedding, $query_embedding), 0.0)"
+        else:
+            rank = "COUNT { (m)--() }"
+
+        hop_cypher = f"""
+        CALL {{
+            WITH frontier
+            UNWIND frontier AS n
+            CALL {{
+                WITH n
+                MATCH (n)-[r]->(m)
+                {rel_filter}
+                WITH r, m ORDER BY {rank} DESC
+                LIMIT $fanout
+                RETURN r, m
+            }}
+            RETURN collect(DISTINCT r) AS hop_edges, collect(DISTINCT m) AS hop_nodes
+        }}
+        WITH seeds, edges + hop_edges AS edges, visited, [m IN hop_nodes WHERE NOT m IN visited] AS frontier
+        WITH seeds, edges, visited + frontier AS visited, frontier[..$budget] AS frontier
+        """
+
+        result = tx.run(f"""
+        {seed_cypher}
+        WITH seeds, seeds AS frontier, seeds AS visited, [] AS edges
+        {hop_cypher * int(hops)}
+        WITH seeds, edges[..$budget] AS edges
+        RETURN [n IN seeds | {{id: elementId(n), name: n.name}}] AS seeds,
+               [r IN edges | {{
+                   id: elementId(r), type: coalesce(r.type, type(r)),
+                   source_id: elementId(startNode(r)), source_name: startNode(r).name,
+                   target_id: elementId(endNode(r)), target_name: endNode(r).name
+               }}] AS edges
+        """, **params, fanout=fanout, budget=budget, rel_types=rel_types, query_embedding=query_embedding)
+
+        record = result.single()
+        if record is None:
+            return {"nodes": [], "edges": []}
+
+        nodes = {node["id"]: node for node in record["seeds"]}
+        for edge in record["edges"]:
+            nodes.setdefault(edge["source_id"], {"id": edge["source_id"], "name": edge["source_name"]})
+            nodes.setdefault(edge["target_id"], {"id": edge["target_id"], "name": edge["target_name"]})
+        return {"nodes": list(nodes.values()), "edges": record["edges"]}
+
     """
     Filter entities based on vector similarity and retrieve their subgraphs within a specified number of hops.
     """
@@ -361,8 +732,9 @@ class GraphDB:
         threshold: float = 0.9, 
         kgdb_name: str = 'neo4j', 
         hops: int = 2, 
-        num_of_res: int = 5
-        ) -> List[Any]:
+        num_of_res: int = 5, 
+        **kwargs
+        ) -> Dict[str, List[Dict[str, Any]]]:
         """
         Parameters:
             entity_name (str): The name of the entity to query.
@@ -370,48 +742,96 @@ class GraphDB:
             kgdb_name (str): The name of the knowledge graph database. Defaults to 'neo4j'.
             hops (int): The number of hops to traverse from each qualified entity. Defaults to 2.
             num_of_res (int): The maximum number of top-ranked entities to consider. Defaults to 5.
+            **kwargs: fanout, budget, rel_types and rank_by of the subgraph expansion.
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: {"nodes": [...], "edges": [...]} of the subgraphs.
+        """
+        return self.query_by_vectors([entity_name], threshold, kgdb_name, hops, num_of_res, **kwargs)
+
+    """
+    Batched version of `query_by_vector`: the vector lookup and the subgraph expansion
+    of all the entities run in one Cypher query, the edges are deduplicated in Neo4j.
+    """
+    def query_by_vectors(
+        self, 
+        entity_names: List[str], 
+        threshold: float = 0.9, 
+        kgdb_name: str = 'neo4j', 
+        hops: int = 2, 
+        num_of_res: int = 5, 
+        **kwargs
+        ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Parameters:
+            entity_names (List[str]): The names of the entities to query.
+            threshold (float): The similarity threshold for filtering entities. Defaults to 0.9.
+            kgdb_name (str): The name of the knowledge graph database. Defaults to 'neo4j'.
+            hops (int): The number of hops to traverse from each qualified entity. Defaults to 2.
+            num_of_res (int): The maximum number of top-ranked entities per name. Defaults to 5.
+            **kwargs: fanout, budget, rel_types and rank_by of the subgraph expansion.
 
         Returns:
-            List[Any]: A list of query results, containing subgraphs of qualified entities.
+            Dict[str, List[Dict[str, Any]]]: {"nodes": [...], "edges": [...]} of the subgraphs.
         """
-        results = self.query_by_vector_tep(entity_name=entity_name)
+        self.use_database(kgdb_name)
+        entity_names = [name.strip() for name in dict.fromkeys(entity_names) if name and name.strip()]
+        if not entity_names:
+            return {"nodes": [], "edges": []}
 
-        # Filter entities with similarity scores above the threshold
-        qualified_entities = [result[0] for result in results[:num_of_res] if result[1] > threshold]
+        with torch.no_grad():
+            embeddings = [_to_list(v) for v in self.embed_model.encode_cached(entity_names)]
+        query_embedding = _to_list(np.mean(np.asarray(embeddings), axis=0))
+
+        if self._cache_ready():
+            seeds = self.cache.search(embeddings, num_of_res=num_of_res, threshold=threshold)
+            return self.cache.expand(seeds, query_embedding=query_embedding, **self._expand_defaults(hops, **kwargs))
+
+        seed_cypher = """
+        UNWIND $embeddings AS embedding
+        CALL db.index.vector.queryNodes('entityEmbeddings', $num_of_res, embedding)
+        YIELD node, score
+        WHERE score > $threshold
+        WITH collect(DISTINCT node) AS seeds
+        """
+        params = {"embeddings": embeddings, "num_of_res": int(num_of_res), "threshold": float(threshold)}
 
-        # Query subgraphs for each qualified entity
-        all_query_results = []
-        for entity in qualified_entities:
-            query_result = self.query_specific_entity(entity_name=entity, hops=hops, kgdb_name=kgdb_name)
-            all_query_results.extend(query_result)
+        with self.driver.session() as session:
+            return session.execute_read(
+                self._expand_subgraph, seed_cypher, params, hops=hops, query_embedding=query_embedding, **kwargs)
 
-        return all_query_results
-    
     # TODO
     def query_node(self, entity_name, hops=2, **kwargs):
         # Add a check to stop the search if the number of nodes is 0.
         if kwargs.get("exact_match"):
             raise NotImplemented("not implement `exact_match`")
         else:
-            return self.query_by_vector(entity_name=entity_name, **kwargs)
+            return self.query_by_vector(entity_name=entity_name, hops=hops, **kwargs)
         
     def query_specific_entity(
         self, 
         entity_name, 
         kgdb_name='neo4j', 
-        hops=2
+        hops=2, 
+        **kwargs
         ):
 
         self.use_database(kgdb_name)
-        def query(tx, entity_name, hops):
-            result = tx.run(f"""
-            MATCH (n {{name: $entity_name}})-[r*1..{hops}]->(m)
-            RETURN n.name AS node_name, r, m.name AS neighbor_name
-            """, entity_name=entity_name)
-            return result.values()
+        seed_cypher = """
+        MATCH (n:Entity {name: $entity_name})
+        WITH collect(n) AS seeds
+        """
+        if kwargs.get("rank_by") == "similarity":
+            kwargs["query_embedding"] = self.get_embedding(entity_name)
+
+        if self._cache_ready():
+            seeds = self.cache.find(entity_name)
+            return self.cache.expand(
+                seeds, query_embedding=kwargs.get("query_embedding"), **self._expand_defaults(hops, **kwargs))
 
         with self.driver.session() as session:
-            return session.execute_read(query, entity_name, hops)
+            return session.execute_read(
+                self._expand_subgraph, seed_cypher, {"entity_name": entity_name}, hops=hops, **kwargs)
         
     def query_all_nodes_and_relationships(
         self, 
@@ -448,39 +868,42 @@ class GraphDB:
         with self.driver.session() as session:
             return session.execute_read(query, relationship_type, hops)
         
+        
     def query_entity_like(
         self, 
         keyword, 
         kgdb_name='neo4j', 
-        hops = 2
+        hops = 2, 
+        **kwargs
         ):
         self.use_database(kgdb_name)
-        def query(tx, keyword, hops):
-            result = tx.run(f"""
-            MATCH (n:Entity)
-            WHERE n.name CONTAINS $keyword
-            MATCH (n)-[r*1..{hops}]->(m)
-            RETURN n, r, m
-            """, keyword=keyword)
-            return result.values()
+        seed_cypher = """
+        MATCH (n:Entity)
+        WHERE n.name CONTAINS $keyword
+        WITH collect(n)[..$max_seeds] AS seeds
+        """
+        params = {"keyword": keyword, "max_seeds": int(kwargs.get("fanout") or self.config.graph_hop_fanout or 20)}
+        if kwargs.get("rank_by") == "similarity":
+            kwargs["query_embedding"] = self.get_embedding(keyword)
 
         with self.driver.session() as session:
-            return session.execute_read(query, keyword, hops)
+            return session.execute_read(self._expand_subgraph, seed_cypher, params, hops=hops, **kwargs)
     
     def query_node_info(
         self, 
         node_name, 
         kgdb_name='neo4j', 
-        hops = 2
+        hops = 2, 
+        **kwargs
         ):
         self.use_database(kgdb_name)
-        def query(tx, node_name, hops):
-            result = tx.run(f"""
-            MATCH (n {{name: $node_name}})
-            OPTIONAL MATCH (n)-[r*1..{hops}]->(m)
-            RETURN n, r, m
-            """, node_name=node_name)
-            return result.values()
+        seed_cypher = """
+        MATCH (n:Entity {name: $node_name})
+        WITH collect(n) AS seeds
+        """
+        if kwargs.get("rank_by") == "similarity":
+            kwargs["query_embedding"] = self.get_embedding(node_name)
 
         with self.driver.session() as session:
-            return session.execute_read(query, node_name, hops)
+            return session.execute_read(
+                self._expand_subgraph, seed_cypher, {"node_name": node_name}, hops=hops, **kwargs)
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.common import setup_logger
+
+logger = setup_logger("JobManager")
+
+FINISHED_STATUS = ["done", "failed"]
+
+class JobManager:
+
+    """ Persistent registry of background jobs run by a worker pool
+    Every job tracks the progress of its files (stage, current / total).
+    Jobs are saved to `path`, jobs interrupted by a restart are queued again
+    once the handler of their type is registered.
+    """
+
+    def __init__(self, path, workers=2, max_finished=200) -> None:
+        self.path = path
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.handlers = {}
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._load_jobs()
+
+    def _load_jobs(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as f:
+            self.jobs = {job["job_id"]: job for job in json.load(f)}
+
+        for job in self.jobs.values():
+            if job["status"] not in FINISHED_STATUS:
+                job["status"] = "queued"
+
+    def _save_jobs(self):
+        with self.lock:
+            finished = sorted([j for j in self.jobs.values() if j["status"] in FINISHED_STATUS],
+                              key=lambda j: j["updated_at"])
+            for job in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self.jobs[job["job_id"]]
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w+") as f:
+                json.dump(list(self.jobs.values()), f, ensure_ascii=False, indent=4)
+
+    def register(self, job_type, handler):
+        """Register the handler `handler(job)` of a job type and resume its queued jobs"""
+        self.handlers[job_type] = handler
+        for job in list(self.jobs.values()):
+            if job["type"] == job_type and job["status"] == "queued":
+                logger.info(f"Resuming job {job['job_id']}")
+                self.executor.submit(self._run, job["job_id"])
+
+    def submit(self, job_type, payload, files=None):
+        assert job_type in self.handlers, f"No handler registered for job type {job_type}"
+        job = {
+            "job_id": "job_" + uuid.uuid4().hex[:12],
+            "type": job_type,
+            "status": "queued",
+            "message": "",
+            "payload": payload,
+            "files": {f["file_id"]: {
+                "filename": f.get("filename"),
+                "status": "waiting",
+                "stage": None,
+                "current": None,
+                "total": None,
+            } for f in files or []},
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        }
+        with self.lock:
+            self.jobs[job["job_id"]] = job
+            self._save_jobs()
+
+        self.executor.submit(self._run, job["job_id"])
+        return job
+
+    def _run(self, job_id):
+        job = self.jobs[job_id]
+        self.update(job_id, status="running")
+        try:
+            self.handlers[job["type"]](job)
+            self.update(job_id, status="done")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self.update(job_id, status="failed", message=str(e))
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._save_jobs()
+
+    def update_file(self, job_id, file_id, persist=False, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            job["files"][file_id].update(fields)
+            job["updated_at"] = time.time()
+            if persist:
+                self._save_jobs()
+
+    def progress_callback(self, job_id, file_id):
+        """Return `progress(stage, current=None, total=None)` reporting the stage of a file"""
+        def progress(stage, current=None, total=None):
+            self.update_file(job_id, file_id, stage=stage, current=current, total=total)
+        return progress
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def list(self, job_type=None):
+        with self.lock:
+            jobs = [j for j in self.jobs.values() if job_type is None or j["type"] == job_type]
+            return json.loads(json.dumps(sorted(jobs, key=lambda j: j["created_at"], reverse=True)))
@@ -1,10 +1,49 @@
 import os
+import math
+from collections import Counter
 
 from src.models import EmbeddingModel
-from pymilvus import MilvusClient, MilvusException
+from pymilvus import MilvusClient, MilvusException, DataType
+from pymilvus import AnnSearchRequest, RRFRanker, WeightedRanker, Function, FunctionType
 from src.common import setup_logger, hashstr
 logger = setup_logger("KnowledgeBase")
 
+# search parameters of each index type per profile, trading recall against latency
+SEARCH_PROFILES = {
+    "fast": {"HNSW": {"ef": 32}, "IVF_FLAT": {"nprobe": 8}, "IVF_PQ": {"nprobe": 8}},
+    "balanced": {"HNSW": {"ef": 64}, "IVF_FLAT": {"nprobe": 16}, "IVF_PQ": {"nprobe": 32}},
+    "accurate": {"HNSW": {"ef": 256}, "IVF_FLAT": {"nprobe": 64}, "IVF_PQ": {"nprobe": 128}},
+}
+
+
+def dense_score(query, vector, metric_type="COSINE"):
+    """The score Milvus reports for `vector` in a dense search of `query`"""
+    query, vector = [float(x) for x in query], [float(x) for x in vector]
+    if metric_type == "L2":
+        return sum((q - v) ** 2 for q, v in zip(query, vector))
+    dot = sum(q * v for q, v in zip(query, vector))
+    if metric_type == "COSINE":
+        norm = math.sqrt(sum(q * q for q in query)) * math.sqrt(sum(v * v for v in vector))
+        return dot / norm if norm else 0.0
+    return dot
+
+
+def reciprocal_rank_fusion(result_lists, limit=None, k=60, metric_type="COSINE"):
+    """Fuse ranked hit lists by reciprocal rank, sum(1 / (k + rank)) per chunk id.
+    The fused hit keeps the best distance it got (the smallest for L2, the largest for IP / COSINE)
+    and records the fused score in `rrf_score`."""
+    best = min if metric_type == "L2" else max
+    fused = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits):
+            entry = fused.setdefault(hit["id"], {**hit, "rrf_score": 0.0})
+            entry["rrf_score"] += 1.0 / (k + rank + 1)
+            entry["distance"] = best(entry["distance"], hit["distance"])
+
+    res = sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)
+    return res[:limit] if limit else res
+
+
 class KnowledgeBase:
 
     def __init__(self, config=None, embed_model=None) -> None:
@@ -12,6 +51,9 @@ class KnowledgeBase:
         assert embed_model, "embed_model=None"
         self.embed_model = embed_model
 
+        self.sparse_fields = {}  # collection_name -> has the BM25 sparse field
+        self.vector_indexes = {} # collection_name -> (index_type, metric_type) of the vector field
+        self.dense_fallbacks = set()  # collections already warned about missing the sparse field
         self.client = None
         if not self.connect_to_milvus():
             raise ConnectionError("Failed to connect to Milvus")
@@ -46,48 +88,292 @@ class KnowledgeBase:
         return collection
 
     def add_collection(self, collection_name, dimension=None):
+        self.sparse_fields.pop(collection_name, None)
+        self.vector_indexes.pop(collection_name, None)
         if self.client.has_collection(collection_name=collection_name):
             logger.warning(f"Collection {collection_name} already exists, drop it")
             self.client.drop_collection(collection_name=collection_name)
 
+        schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=True)
+        schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+        schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dimension)
+        schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=65535,
+                         enable_analyzer=True, analyzer_params={"type": "chinese"})
+        schema.add_field(field_name="file_id", datatype=DataType.VARCHAR, max_length=128)
+        schema.add_field(field_name="hash", datatype=DataType.VARCHAR, max_length=64)
+        if self.config.get("enable_hybrid_search"):
+            # BM25 sparse vectors of the text are computed by Milvus on insert
+            schema.add_field(field_name="sparse", datatype=DataType.SPARSE_FLOAT_VECTOR)
+            schema.add_function(Function(
+                name="text_bm25",
+                function_type=FunctionType.BM25,
+                input_field_names=["text"],
+                output_field_names=["sparse"]))
+
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(
+            field_name="vector",
+            index_type=self.config.get("vector_index_type") or "HNSW",
+            metric_type=self.config.get("vector_metric_type") or "COSINE",
+            params=self.config.get("vector_index_params") or {"M": 16, "efConstruction": 200})
+        index_params.add_index(field_name="file_id", index_type="INVERTED")
+        if self.config.get("enable_hybrid_search"):
+            index_params.add_index(field_name="sparse", index_type="SPARSE_INVERTED_INDEX", metric_type="BM25")
+
         self.client.create_collection(
             collection_name=collection_name,
-            dimension= dimension,  # The vectors we will use in this demo has 768 dimensions
+            schema=schema,
+            index_params=index_params,
         )
 
-    def add_documents(self, docs, collection_name, **kwargs):
+    def has_explicit_schema(self, collection_name):
+        """Collections created by the quick setup keep file_id / hash in the dynamic field,
+        with hybrid search enabled the collection also needs the BM25 sparse field"""
+        fields = self.client.describe_collection(collection_name).get("fields", [])
+        names = {field["name"] for field in fields}
+        return "file_id" in names and ("sparse" in names or not self.config.get("enable_hybrid_search"))
+
+    def has_sparse_field(self, collection_name):
+        if collection_name not in self.sparse_fields:
+            fields = self.client.describe_collection(collection_name).get("fields", [])
+            self.sparse_fields[collection_name] = any(field["name"] == "sparse" for field in fields)
+        return self.sparse_fields[collection_name]
+
+    def migrate_collection(self, collection_name, dimension, batch_size=1000):
+        """Copy a quick-setup collection into a collection with the explicit schema
+
+        Every row is copied, with or without a known file_id. The old collection is renamed
+        aside and only dropped once the new one has taken its name, so a crash leaves either
+        the old or the new collection in place (see `recover_migration`)."""
+        self.recover_migration(collection_name)
+        if self.has_explicit_schema(collection_name):
+            logger.info(f"Collection {collection_name} already has an explicit schema")
+            return False
+
+        tmp_name, backup_name = f"{collection_name}_migrating", f"{collection_name}_backup"
+        if self.client.has_collection(collection_name=tmp_name):
+            self.client.drop_collection(collection_name=tmp_name)  # partial copy of an interrupted migration
+        self.add_collection(tmp_name, dimension)
+
+        total = 0
+        iterator = self.client.query_iterator(
+            collection_name, batch_size=batch_size,
+            output_fields=["id", "vector", "text", "file_id", "hash"])
+        try:
+            while rows := iterator.next():
+                for row in rows:
+                    row["hash"] = row.get("hash") or self.chunk_hash(row["text"])
+                self.client.insert(collection_name=tmp_name, data=rows)
+                total += len(rows)
+        finally:
+            iterator.close()
+        logger.info(f"Copied {total} chunks of {collection_name}")
+
+        self.client.rename_collection(old_name=collection_name, new_name=backup_name)
+        self.client.rename_collection(old_name=tmp_name, new_name=collection_name)
+        self.client.drop_collection(collection_name=backup_name)
+        self.sparse_fields.pop(collection_name, None)
+        self.vector_indexes.pop(collection_name, None)
+        logger.info(f"Collection {collection_name} migrated to the explicit schema")
+        return True
+
+    def recover_migration(self, collection_name):
+        """Finish the swap of a migration interrupted between the two renames"""
+        tmp_name, backup_name = f"{collection_name}_migrating", f"{collection_name}_backup"
+        if not self.client.has_collection(collection_name=backup_name):
+            return
+
+        if not self.client.has_collection(collection_name=collection_name):
+            logger.warning(f"Resuming the interrupted migration of {collection_name}")
+            self.client.rename_collection(old_name=tmp_name, new_name=collection_name)
+        self.client.drop_collection(collection_name=backup_name)
+        self.sparse_fields.pop(collection_name, None)
+        self.vector_indexes.pop(collection_name, None)
+
+    def add_documents(self, docs, collection_name, progress=None, **kwargs):
 
-        import random
         if not self.client.has_collection(collection_name=collection_name):
             logger.error(f"Collection {collection_name} not found, create it")
             self.add_collection(collection_name)
 
-        vectors = self.embed_model.encode(docs)
+        batch_size = int(self.config.get("embed_batch_size") or 64)
+        total = (len(docs) + batch_size - 1) // batch_size
+        vectors = []
+        for i in range(0, len(docs), batch_size):
+            if progress:
+                progress("embedding", i // batch_size + 1, total)
+            vectors.extend(self.embed_model.encode(docs[i:i + batch_size]))
+
+        if progress:
+            progress("inserting")
+
+        data = self.build_rows(docs, vectors, **kwargs)
+        res = self.client.insert(collection_name=collection_name, data=data)
+        return res
 
-        data = [{
+    def build_rows(self, docs, vectors, **kwargs):
+        import random
+        return [{
             "id": int(random.random() * 1e12),
             "vector": vectors[i],
             "text": docs[i],
-            "hash": hashstr(docs[i], with_salt=True),
+            "hash": self.chunk_hash(docs[i]),
             **kwargs} for i in range(len(vectors))]
 
-        res = self.client.insert(collection_name=collection_name, data=data)
+    def chunk_hash(self, text):
+        """Deterministic content hash of a chunk"""
+        return hashstr(text, length=32)
+
+    def get_file_chunks(self, collection_name, file_id, output_fields=["id", "hash"], batch_size=1000):
+        """All the chunks of a file, read in batches since a single query is capped by Milvus"""
+        rows = []
+        iterator = self.client.query_iterator(
+            collection_name, batch_size=batch_size,
+            filter=f"file_id == '{file_id}'",
+            output_fields=output_fields)
+        try:
+            while batch := iterator.next():
+                rows.extend(batch)
+        finally:
+            iterator.close()
+        return rows
+
+    def upsert_documents(self, docs, collection_name, file_id, progress=None):
+        """Sync the chunks of a file with `docs` by content hash:
+        only the new chunks are embedded and inserted, the removed ones are deleted."""
+        if progress:
+            progress("diffing")
+
+        hashes = [self.chunk_hash(doc) for doc in docs]
+        wanted = Counter(hashes)
+        kept = Counter()
+        to_delete = []
+        for row in self.get_file_chunks(collection_name, file_id):
+            if kept[row["hash"]] < wanted[row["hash"]]:
+                kept[row["hash"]] += 1
+            else:
+                to_delete.append(row["id"])
+
+        to_insert = []
+        for doc, h in zip(docs, hashes):
+            if kept[h] > 0:
+                kept[h] -= 1
+            else:
+                to_insert.append(doc)
+
+        if to_insert:
+            self.add_documents(to_insert, collection_name, progress=progress, file_id=file_id)
+        if to_delete:
+            self.client.delete(collection_name=collection_name, ids=to_delete)
+
+        result = {"inserted": len(to_insert), "deleted": len(to_delete), "unchanged": len(docs) - len(to_insert)}
+        logger.info(f"Upserted {file_id} in {collection_name}: {result}")
+        return result
+
+    def describe_vector_index(self, collection_name):
+        """(index_type, metric_type) of the vector field as built in Milvus, (None, None) without index"""
+        if collection_name not in self.vector_indexes:
+            info = (None, None)
+            for index_name in self.client.list_indexes(collection_name, field_name="vector"):
+                index = self.client.describe_index(collection_name, index_name)
+                info = (index.get("index_type"), index.get("metric_type"))
+                break
+            self.vector_indexes[collection_name] = info
+        return self.vector_indexes[collection_name]
+
+    def get_search_params(self, profile, index_type=None, metric_type=None, collection_name=None):
+        """Search parameters of `profile` for the given index type, ef for HNSW and nprobe for IVF.
+        The index type and metric are the ones the index was built with; when they were not recorded
+        (collections created before), they are read from the index of `collection_name`."""
+        if (index_type is None or metric_type is None) and collection_name:
+            built_index_type, built_metric_type = self.describe_vector_index(collection_name)
+            index_type = index_type or built_index_type
+            metric_type = metric_type or built_metric_type
+        metric_type = metric_type or self.config.get("vector_metric_type") or "COSINE"
+
+        params = SEARCH_PROFILES.get(profile or "balanced", SEARCH_PROFILES["balanced"]).get(index_type)
+        if params is None:
+            return None
+        return {"metric_type": metric_type, "params": dict(params)}
+
+    def search(self, query, collection_name, limit=3, search_params=None, search_mode="dense"):
+
+        query_vectors = self.embed_model.encode_queries_cached([query])
+        if self._use_hybrid(collection_name, search_mode):
+            return self._hybrid_search([query], query_vectors, collection_name, limit, search_params)[0]
+        return self.search_by_vector(query_vectors[0], collection_name, limit, search_params=search_params)
+
+    def multi_search(self, queries, collection_name, limit=3, search_params=None, search_mode="dense"):
+        """Encode `queries` in one batch, search them in one request and fuse the hits with RRF"""
+        query_vectors = self.embed_model.encode_queries_cached(queries)
+        if self._use_hybrid(collection_name, search_mode):
+            res = self._hybrid_search(queries, query_vectors, collection_name, limit, search_params)
+        else:
+            res = self._search(query_vectors, collection_name, limit, search_params)
+        metric_type = (search_params or {}).get("metric_type") or self.describe_vector_index(collection_name)[1]
+        return reciprocal_rank_fusion(res, limit=limit, metric_type=metric_type)
+
+    def _use_hybrid(self, collection_name, search_mode):
+        if search_mode != "hybrid":
+            return False
+        if not self.has_sparse_field(collection_name):
+            if collection_name not in self.dense_fallbacks:
+                self.dense_fallbacks.add(collection_name)
+                logger.warning(f"Collection {collection_name} has no sparse field, fallback to dense search, "
+                               f"migrate it to enable hybrid search")
+            return False
+        return True
+
+    def _hybrid_search(self, queries, vectors, collection_name, limit=3, search_params=None):
+        """Dense and BM25 sparse search fused by Milvus in one request.
+        Hits are ranked by the fused score, rescaled to [0, 1] and kept in `rrf_score`,
+        `distance` stays the dense similarity so that distance thresholds keep their meaning."""
+        search_params = dict(search_params or {})
+        if "ef" in search_params.get("params", {}):
+            search_params["params"] = {**search_params["params"], "ef": max(search_params["params"]["ef"], limit)}
+        metric_type = search_params.get("metric_type") or self.describe_vector_index(collection_name)[1] or "COSINE"
+
+        dense = AnnSearchRequest(data=list(vectors), anns_field="vector", param=search_params, limit=limit)
+        sparse = AnnSearchRequest(data=list(queries), anns_field="sparse", param={"metric_type": "BM25"}, limit=limit)
+
+        if self.config.get("hybrid_ranker") == "weighted":
+            dense_weight = float(self.config.get("hybrid_dense_weight") or 0.6)
+            ranker, scale = WeightedRanker(dense_weight, 1 - dense_weight), 1.0
+        else:
+            ranker, scale = RRFRanker(60), (60 + 1) / 2  # a chunk ranked first by both routes scores 1
+
+        res = self.client.hybrid_search(
+            collection_name=collection_name,
+            reqs=[dense, sparse],
+            ranker=ranker,
+            limit=limit,
+            output_fields=["text", "file_id", "vector"],
+        )
+
+        for query_vector, hits in zip(vectors, res):
+            for hit in hits:
+                hit["rrf_score"] = hit["distance"] * scale
+                hit["distance"] = dense_score(query_vector, hit["entity"].pop("vector"), metric_type)
         return res
 
-    def search(self, query, collection_name, limit=3):
+    def search_by_vector(self, vector, collection_name, limit=3, search_params=None):
+        return self._search([vector], collection_name, limit, search_params)[0]
 
-        query_vectors = self.embed_model.encode_queries([query])
-        return self.search_by_vector(query_vectors[0], collection_name, limit)
+    def _search(self, vectors, collection_name, limit=3, search_params=None):
+        search_params = dict(search_params or {})
+        if "ef" in search_params.get("params", {}):
+            # HNSW requires ef >= limit
+            search_params["params"] = {**search_params["params"], "ef": max(search_params["params"]["ef"], limit)}
 
-    def search_by_vector(self, vector, collection_name, limit=3):
         res = self.client.search(
             collection_name=collection_name,  # target collection
-            data=[vector],  # query vectors
+            data=list(vectors),  # query vectors
             limit=limit,  # number of returned entities
+            search_params=search_params,  # ef / nprobe of the search profile
             output_fields=["text", "file_id"],  # specifies fields to be returned
         )
 
-        return res[0]
+        return res
 
     def examples(self, collection_name, limit=20):
         res = self.client.query(
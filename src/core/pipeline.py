@@ -0,0 +1,239 @@
+import time
+import queue
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from src.common import setup_logger
+from src.common.parsing import parse_file_in_worker
+
+logger = setup_logger("IngestionPipeline")
+
+_PARSE_POOL = None
+_MANAGER = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_parse_pool(workers):
+    """Parse pool and progress manager shared by all ingestion runs.
+    The workers outlive the jobs, so the OCR engine they load stays warm for the next files."""
+    global _PARSE_POOL, _MANAGER
+    with _POOL_LOCK:
+        ctx = multiprocessing.get_context("spawn")
+        if _MANAGER is None:
+            _MANAGER = ctx.Manager()
+        if _PARSE_POOL is None or _PARSE_POOL._max_workers != workers:
+            if _PARSE_POOL is not None:
+                _PARSE_POOL.shutdown(wait=False)
+            _PARSE_POOL = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        return _PARSE_POOL, _MANAGER
+
+
+def reset_parse_pool(pool):
+    """Drop `pool` after a worker died, the next run starts a new one"""
+    global _PARSE_POOL
+    with _POOL_LOCK:
+        if _PARSE_POOL is pool:
+            _PARSE_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _shutdown_parse_pool():
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(wait=False, cancel_futures=True)
+    if _MANAGER is not None:
+        _MANAGER.shutdown()
+
+
+class IngestionPipeline:
+
+    """ Staged document ingestion: parse -> embed -> insert
+    - parse: files are read and chunked in a process pool kept across runs;
+    - embed: chunks are encoded in batches of `embed_batch_size`;
+    - insert: rows are written to Milvus in batches of `insert_batch_size`.
+    The stages run concurrently across files and are linked by bounded queues,
+    so a slow stage holds back the ones before it.
+    """
+
+    def __init__(self, knowledge_base, config) -> None:
+        self.knowledge_base = knowledge_base
+        self.parse_workers = int(config.parse_workers or 4)
+        self.embed_batch_size = int(config.embed_batch_size or 64)
+        self.insert_batch_size = int(config.insert_batch_size or 1000)
+        self.queue_size = int(config.ingest_queue_size or 8)
+
+    def run(self, collection_name, files, params=None, progress=None, on_done=None):
+        """Ingest `files` ([{"file_id", "path", "type"}]) and block until all of them are finished
+
+        - progress(file_id, stage, current=None, total=None) reports the stage of a file;
+        - on_done(file_id, status) is called once per file with "done" or "failed".
+        """
+        progress = progress or (lambda *args, **kwargs: None)
+        on_done = on_done or (lambda *args: None)
+
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        insert_queue = queue.Queue(maxsize=self.queue_size)
+        lock = threading.Lock()
+        remaining = {}  # file_id -> number of chunks not inserted yet
+        finished = {}   # file_id -> status
+
+        def finish(file_id, status):
+            with lock:
+                if file_id in finished:
+                    return
+                finished[file_id] = status
+            on_done(file_id, status)
+
+        start = time.time()
+        embedder = threading.Thread(
+            target=self._embed_stage, name="ingest-embed",
+            args=(embed_queue, insert_queue, remaining, lock, progress, finish))
+        inserter = threading.Thread(
+            target=self._insert_stage, name="ingest-insert",
+            args=(collection_name, insert_queue, remaining, lock, progress, finish))
+        embedder.start()
+        inserter.start()
+
+        try:
+            self._parse_stage(files, params, embed_queue, progress, finish)
+        finally:
+            embed_queue.put(None)
+            embedder.join()
+            inserter.join()
+
+            # files still pending when the parse stage raised are failed too
+            for file in files:
+                finish(file["file_id"], "failed")
+
+            failed = [file_id for file_id, status in finished.items() if status == "failed"]
+            for file_id in failed:
+                # drop the chunks of the failed files that reached Milvus
+                self.knowledge_base.client.delete(
+                    collection_name=collection_name,
+                    filter=f"file_id == '{file_id}'")
+
+        logger.info(f"Ingested {len(files) - len(failed)}/{len(files)} files in {time.time() - start:.2f}s")
+        return finished
+
+    def _parse_stage(self, files, params, embed_queue, progress, finish):
+        pool, manager = get_parse_pool(self.parse_workers)
+        # the workers report reading / OCR / chunking progress and their OCR timings through this queue
+        events = manager.Queue()
+        relay = threading.Thread(target=self._relay_progress, args=(events, progress), name="ingest-progress")
+        relay.start()
+        try:
+            self._parse_files(pool, events, files, params, embed_queue, progress, finish)
+        except BrokenProcessPool:
+            reset_parse_pool(pool)
+            raise
+        finally:
+            events.put(None)
+            relay.join()
+
+    def _relay_progress(self, events, progress):
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            kind, payload = event
+            if kind == "ocr":
+                # pages recognized by the engine of a worker, counted in the shared OCR metrics
+                from src.plugins.pdf2txt import OCR_SERVICE
+                OCR_SERVICE.record(**payload)
+            else:
+                progress(*payload)
+
+    def _parse_files(self, pool, events, files, params, embed_queue, progress, finish):
+        pending = list(files)
+        in_flight = {}
+        while pending or in_flight:
+            while pending and len(in_flight) < self.parse_workers * 2:
+                file = pending.pop(0)
+                progress(file["file_id"], "parsing")
+                future = pool.submit(parse_file_in_worker, events, file["file_id"], file["path"], file["type"], params)
+                in_flight[future] = file
+
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                file = in_flight.pop(future)
+                try:
+                    chunks = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    logger.error(f"Failed to parse {file['path']}, {e}")
+                    finish(file["file_id"], "failed")
+                    continue
+                embed_queue.put((file["file_id"], chunks))  # blocks while the embedder is behind
+
+    def _embed_stage(self, embed_queue, insert_queue, remaining, lock, progress, finish):
+        while True:
+            item = embed_queue.get()
+            if item is None:
+                insert_queue.put(None)
+                return
+
+            file_id, chunks = item
+            if not chunks:
+                finish(file_id, "done")
+                continue
+
+            with lock:
+                remaining[file_id] = len(chunks)
+
+            total = (len(chunks) + self.embed_batch_size - 1) // self.embed_batch_size
+            try:
+                for i in range(0, len(chunks), self.embed_batch_size):
+                    progress(file_id, "embedding", i // self.embed_batch_size + 1, total)
+                    batch = chunks[i:i + self.embed_batch_size]
+                    vectors = self.knowledge_base.embed_model.encode(batch)
+                    rows = self.knowledge_base.build_rows(batch, vectors, file_id=file_id)
+                    insert_queue.put((file_id, rows))  # blocks while the inserter is behind
+            except Exception as e:
+                logger.error(f"Failed to embed chunks of {file_id}, {e}")
+                finish(file_id, "failed")
+
+    def _insert_stage(self, collection_name, insert_queue, remaining, lock, progress, finish):
+        buffer = []
+        size = 0
+
+        def flush():
+            rows = [row for _, batch in buffer for row in batch]
+            file_ids = [file_id for file_id, _ in buffer]
+            for file_id in dict.fromkeys(file_ids):
+                progress(file_id, "inserting")
+
+            try:
+                self.knowledge_base.client.insert(collection_name=collection_name, data=rows)
+            except Exception as e:
+                logger.error(f"Failed to insert {len(rows)} rows into {collection_name}, {e}")
+                for file_id in set(file_ids):
+                    finish(file_id, "failed")
+                return
+
+            for file_id, batch in buffer:
+                with lock:
+                    remaining[file_id] -= len(batch)
+                    left = remaining[file_id]
+                if left == 0:
+                    finish(file_id, "done")
+
+        while True:
+            try:
+                item = insert_queue.get(timeout=0.5)
+            except queue.Empty:
+                item = False  # idle, write what we have
+
+            if item:
+                buffer.append(item)
+                size += len(item[1])
+
+            if buffer and (item is None or item is False or size >= self.insert_batch_size):
+                flush()
+                buffer, size = [], 0
+
+            if item is None:
+                return
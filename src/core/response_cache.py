@@ -0,0 +1,127 @@
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from src.common import setup_logger
+logger = setup_logger("ResponseCache")
+
+class ResponseCache:
+    """
+    Response cache in front of `model.predict`, keyed on the final prompt messages and model name.
+    - exact: the serialized messages must match exactly;
+    - semantic: the rest of the prompt (model, system, context, history) must match exactly,
+      the most similar cached question is reused if its cosine similarity >= threshold.
+    Entries expire after `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        mode: str = "exact",
+        threshold: float = 0.95,
+        ttl: float = 3600,
+        max_items: int = 1000,
+        embed_model = None
+    ):
+        if mode == "semantic" and embed_model is None:
+            logger.warning("Semantic response cache requires an embedding model, fallback to exact mode")
+            mode = "exact"
+
+        self.mode = mode
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self.embed_model = embed_model
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config, embed_model=None):
+        return cls(
+            mode=config.response_cache_mode or "exact",
+            threshold=float(config.response_cache_threshold or 0.95),
+            ttl=float(config.response_cache_ttl or 3600),
+            max_items=int(config.response_cache_size or 1000),
+            embed_model=embed_model)
+
+    def _split(self, messages, question=None):
+        """Split the prompt into the user question and the rest of it (system, context, history).
+        `question` defaults to the last message, in RAG prompts it is wrapped by the reference material."""
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        last = messages[-1]["content"] if messages else ""
+        question = question or last
+        rest = messages[:-1] + [{**messages[-1], "content": last.replace(question, "{question}")}] if messages else []
+        return question, json.dumps(rest, ensure_ascii=False)
+
+    def _key(self, *parts):
+        return hashlib.sha1("\x00".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+    def _embed(self, text):
+        vector = np.asarray(self.embed_model.encode([text])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [k for k, v in self.items.items() if now - v["created_at"] > self.ttl]
+        for key in expired:
+            del self.items[key]
+
+    def get(self, messages, model_name, question=None):
+        question, rest = self._split(messages, question)
+        context_key = self._key(model_name, rest)
+        key = self._key(context_key, question)
+        vector = self._embed(question) if self.mode == "semantic" else None
+
+        with self.lock:
+            self._evict_expired()
+            entry = self.items.get(key)
+            if entry is None and vector is not None:
+                # only the question is compared, the rest of the prompt must match exactly
+                candidates = [v for v in self.items.values() if v["context_key"] == context_key]
+                if candidates:
+                    scores = np.stack([c["vector"] for c in candidates]) @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        entry = candidates[best]
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.items.move_to_end(entry["key"])
+            return entry["content"]
+
+    def put(self, messages, model_name, content, question=None):
+        if not content:
+            return
+
+        question, rest = self._split(messages, question)
+        context_key = self._key(model_name, rest)
+        key = self._key(context_key, question)
+        vector = self._embed(question) if self.mode == "semantic" else None
+
+        with self.lock:
+            self.items[key] = {
+                "key": key,
+                "context_key": context_key,
+                "content": content,
+                "vector": vector,
+                "created_at": time.time(),
+            }
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "items": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,4 +1,8 @@
-from src.models.embedding import Reranker
+import re
+import time
+import asyncio
+
+from src.models.embedding import Reranker, RerankBatcher
 from src.common import setup_logger
 
 logger = setup_logger("server-retriever")
@@ -13,17 +17,41 @@ class Retriever:
 
         if self.config.enable_reranker:
             self.reranker = Reranker(config)
+            if self.config.enable_rerank_batcher:
+                self.reranker = RerankBatcher(
+                    self.reranker,
+                    window_ms=float(self.config.rerank_batch_window_ms or 5),
+                    max_pairs=int(self.config.reranker_batch_size or 32))
+
+    async def aretrieval(self, query, history, meta):
+        """异步检索调度：
+        - 实体识别与查询改写 + 知识库检索并行执行；
+        - 实体识别完成后立即开始图数据库检索；
+        - 各阶段耗时记录在 refs["timings"] 中（单位：秒）。
+        """
+        refs = {"query": query, "history": history, "meta": meta, "timings": {}}
+        refs["model_name"] = self.config.model_name
+        start = time.perf_counter()
 
-    def retrieval(self, query, history, meta):
+        async def graph_stage():
+            refs["entities"] = await self._timed(refs, "entities", self.areco_entities(query, history, refs))
+            return await self._timed(refs, "graph_base", asyncio.to_thread(self.query_graph, query, history, refs))
 
-        refs = {"query": query, "history": history, "meta": meta}
-        refs["model_name"] = self.config.model_name
-        refs["entities"] = self.reco_entities(query, history, refs)
-        refs["knowledge_base"] = self.query_knowledgebase(query, history, refs)
-        refs["graph_base"] = self.query_graph(query, history, refs)
+        refs["knowledge_base"], refs["graph_base"] = await asyncio.gather(
+            self._timed(refs, "knowledge_base", self.aquery_knowledgebase(query, history, refs)),
+            graph_stage(),
+        )
 
+        refs["timings"]["total"] = round(time.perf_counter() - start, 4)
         return refs
 
+    async def _timed(self, refs, stage, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            refs.setdefault("timings", {})[stage] = round(time.perf_counter() - start, 4)
+
     def construct_query(self, query, refs, meta):
         if not refs or len(refs) == 0:
             return query
@@ -38,9 +66,10 @@ class Retriever:
 
         # 解析图数据库的结果
         db_res = refs.get("graph_base", {}).get("results", {})
-        if db_res.get("nodes") and len(db_res["nodes"]) > 0:
+        if db_res.get("edges"):
+            # 只有种子节点、没有关系时不加入图数据库信息，避免空的段落
             db_text = "\n".join(
-                [f"{edge['source_name']}和{edge['target_name']}的关系是{edge['type']}" for edge in db_res.get("edges", [])]
+                [f"{edge['source_name']}和{edge['target_name']}的关系是{edge['type']}" for edge in db_res["edges"]]
             )
             external_parts.extend(["图数据库信息:", db_text])
 
@@ -62,15 +91,26 @@ class Retriever:
     def query_graph(self, query, history, refs):
         # res = model.predict("qiansdgsa, dasdh ashdsakjdk ak ").content
 
-        results = []
+        results = {"nodes": [], "edges": []}
         if refs["meta"].get("use_graph") and self.config.enable_knowledge_base:
-            for entity in refs["entities"]:
-                result = self.dbm.graph_base.query_by_vector(entity)
-                if result != []:
-                    results.extend(result)
-        return {"results": self.format_query_results(results)}
-
-    def query_knowledgebase(self, query, history, refs):
+            # 所有实体的向量检索与子图扩展在一次 Cypher 查询中完成，跳数、每跳扇出与总边数不超过配置的上限
+            meta = refs["meta"]
+            results = self.dbm.graph_base.query_by_vectors(
+                refs["entities"],
+                hops=meta.get("graphHops", 2),
+                fanout=meta.get("graphFanout"),
+                budget=meta.get("graphMaxEdges"))
+        return {"results": results}
+
+    async def aquery_knowledgebase(self, query, history, refs):
+        """异步查询知识库，查询改写走异步 LLM 调用，检索与重排在线程中执行"""
+        rw_query = None
+        if refs["meta"].get("db_name") and self.config.enable_knowledge_base:
+            rw_query = await self._timed(refs, "rewrite_query", self.arewrite_query(query, history, refs))
+
+        return await self._timed(refs, "search", asyncio.to_thread(self.query_knowledgebase, query, history, refs, rw_query))
+
+    def query_knowledgebase(self, query, history, refs, rw_query=None):
         """查询知识库"""
 
         kb_res = []
@@ -85,7 +125,7 @@ class Retriever:
                 "message": "Knowledge base is disabled",
             }
 
-        rw_query = self.rewrite_query(query, history, refs)
+        rw_query = rw_query or query  # 改写由 arewrite_query 完成后传入
 
         kb = self.dbm.metaname2db[db_name]
         logger.debug(f"{refs['meta']=}")
@@ -96,7 +136,20 @@ class Retriever:
         distance_threshold = meta.get("distanceThreshold", 0)
         top_k = meta.get("topK", 5)
 
-        all_kb_res = self.dbm.knowledge_base.search(rw_query, db_name, limit=max_query_count)
+        search_profile = meta.get("searchProfile") or kb.search_profile
+        search_params = self.dbm.knowledge_base.get_search_params(
+            search_profile, kb.index_type, kb.metric_type, collection_name=kb.metaname)
+
+        # multi 模式下 rw_query 为 [原始问题, 改写问题..., 伪文档]，一次请求检索全部查询并用 RRF 融合
+        queries = rw_query if isinstance(rw_query, list) else [rw_query]
+        rw_query = queries[0]
+        search_mode = meta.get("searchMode") or self.config.search_mode or "dense"
+        if len(queries) > 1:
+            all_kb_res = self.dbm.knowledge_base.multi_search(
+                queries, db_name, limit=max_query_count, search_params=search_params, search_mode=search_mode)
+        else:
+            all_kb_res = self.dbm.knowledge_base.search(
+                rw_query, db_name, limit=max_query_count, search_params=search_params, search_mode=search_mode)
         for r in all_kb_res:
             r["file"] = kb.id2file(r["entity"]["file_id"])
 
@@ -107,45 +160,65 @@ class Retriever:
             kb_res = [r for r in all_kb_res if r["distance"] > distance_threshold]
 
         if self.config.enable_reranker:
-            for r in kb_res:
-                r["rerank_score"] = self.reranker.compute_score([rw_query, r["entity"]["text"]], normalize=True)[0]
+            scores = self.reranker.score_pairs([[rw_query, r["entity"]["text"]] for r in kb_res])
+            for r, score in zip(kb_res, scores):
+                r["rerank_score"] = score
             kb_res.sort(key=lambda x: x["rerank_score"], reverse=True)
             kb_res = [_res for _res in kb_res if _res["rerank_score"] > rerank_threshold]
 
         kb_res = kb_res[:top_k]
 
-        return {"results": kb_res, "all_results": all_kb_res, "rw_query": rw_query}
+        return {"results": kb_res, "all_results": all_kb_res, "rw_query": rw_query, "rw_queries": queries}
 
-    def rewrite_query(self, query, history, refs):
-        """重写查询"""
+    async def arewrite_query(self, query, history, refs):
+        """重写查询，multi 模式返回查询列表，改写与伪文档生成并行执行"""
         rewrite_query_span = refs["meta"].get("rewriteQuery", "off")
+        if rewrite_query_span == "multi":
+            rewritten, hy_doc = await asyncio.gather(
+                self.model.apredict(self._multi_rewrite_prompt(query, history)),
+                self.model.apredict(query))
+            return self._multi_queries(query, rewritten.content, hy_doc.content)
+
         if rewrite_query_span == "off":
             rewritten_query = query
         else:
-            from src.common.prompts import rewritten_query_prompt_template
-
-            history_query = [entry["content"] for entry in history if entry["role"] == "user"] if history else ""
-            rewritten_query_prompt = rewritten_query_prompt_template.format(history=history_query, query=query)
-            rewritten_query = self.model.predict(rewritten_query_prompt).content
+            rewritten_query = (await self.model.apredict(self._rewrite_prompt(query, history))).content
 
         if rewrite_query_span == "hyde":
-            hy_doc = self.model.predict(rewritten_query).content
+            hy_doc = (await self.model.apredict(rewritten_query)).content
             rewritten_query = f"{rewritten_query} {hy_doc}"
 
         return rewritten_query
 
-    def reco_entities(self, query, history, refs):
+    def _history_queries(self, history):
+        return [entry["content"] for entry in history if entry["role"] == "user"] if history else ""
+
+    def _rewrite_prompt(self, query, history):
+        from src.common.prompts import rewritten_query_prompt_template
+        return rewritten_query_prompt_template.format(history=self._history_queries(history), query=query)
+
+    def _multi_rewrite_prompt(self, query, history):
+        from src.common.prompts import rewritten_query_prompt_template2
+        return rewritten_query_prompt_template2.format(history=self._history_queries(history), query=query)
+
+    def _multi_queries(self, query, rewritten, hy_doc, max_rewrites=4):
+        """将改写结果按行拆分为多个查询（去掉序号），与原始问题和伪文档组成查询列表"""
+        rewrites = [re.sub(r"^\s*(\d+[.、:：)]|[-*•])\s*", "", line).strip() for line in rewritten.splitlines()]
+        queries = [query] + [q for q in rewrites if q][:max_rewrites]
+        if hy_doc:
+            queries.append(hy_doc)
+        return list(dict.fromkeys(queries))
+
+    async def areco_entities(self, query, history, refs):
         """识别句子中的实体"""
         query = refs.get("rewritten_query", query)
 
         entities = []
         if refs["meta"].get("use_graph"):
-            from src.common.prompts import entity_extraction_prompt_template as entity_template
             from src.common.prompts import keywords_prompt_template as entity_template
 
             entity_extraction_prompt = entity_template.format(text=query)
-            entities = self.model.predict(entity_extraction_prompt).content.split("<->")
-            # entities = [entity for entity in entities if all(char.isalnum() or char in "汉字" for char in entity)]
+            entities = (await self.model.apredict(entity_extraction_prompt)).content.split("<->")
 
         return entities
 
@@ -202,30 +275,7 @@ class Retriever:
 
         return formatted_results
 
-    def format_query_results(self, results):
-        formatted_results = {"nodes": [], "edges": []}
-        node_dict = {}
-
-        for item in results:
-            if not isinstance(item[1], list) or not item[1]:
-                continue
-
-            relationship = item[1][0]
-            source_name = item[0]
-            target_name = item[2] if len(item) > 2 else "unknown"
-
-            node_info, edge_info = self._extract_relationship_info(relationship, source_name, target_name)
-            if node_info is None or edge_info is None:
-                continue
-
-            node_dict.update({node["id"]: node for node in node_info})
-            formatted_results["edges"].append(edge_info)
-
-        formatted_results["nodes"] = list(node_dict.values())
-
-        return formatted_results
-
-    def __call__(self, query, history, meta):
-        refs = self.retrieval(query, history, meta)
+    async def __call__(self, query, history, meta):
+        refs = await self.aretrieval(query, history, meta)
         query = self.construct_query(query, refs, meta)
         return query, refs
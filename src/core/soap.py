@@ -1,5 +1,6 @@
 from src.core import DataBaseManager
 from src.core.retriever import Retriever
+from src.core.response_cache import ResponseCache
 from src.models import select_model
 from src.config import Config
 from src.common import setup_logger
@@ -15,6 +16,9 @@ class SOAP:
         self.model = select_model(self.config)
         self.dbm = DataBaseManager(self.config)
         self.retriever = Retriever(self.config, self.dbm, self.model)
+        self.response_cache = None
+        if self.config.enable_response_cache:
+            self.response_cache = ResponseCache.from_config(self.config, self.dbm.embed_model)
 
     def restart(self):
         logger.info("Restarting...")
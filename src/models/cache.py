@@ -0,0 +1,119 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from src.common import setup_logger
+logger = setup_logger("EmbeddingCache")
+
+class EmbeddingCache:
+    """
+    Embedding cache keyed by (embed model name, instruction, text).
+    The in-process LRU holds up to `max_items` read-only vectors; when `cache_dir` is given,
+    vectors are also kept in a sqlite file holding up to `max_disk_items` vectors.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_items: int = 10000,
+        cache_dir: str = None,
+        max_disk_items: int = 1000000
+    ):
+        self.model_name = model_name
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cache_dir, "embeddings.db"), check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, accessed REAL)")
+            self.db.commit()
+            self.disk_count = self.db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+            logger.info(f"Embedding cache loaded from {cache_dir}, {self.disk_count} vectors on disk")
+
+    def key(self, text, instruction=None):
+        raw = f"{self.model_name}\x00{instruction or ''}\x00{text}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text, instruction=None):
+        key = self.key(text, instruction)
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.db.execute("UPDATE embeddings SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self.db.commit()
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._put_memory(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, text, vector, instruction=None):
+        key = self.key(text, instruction)
+        vector = np.array(vector, dtype=np.float32)  # a private copy, stored read-only
+        vector.setflags(write=False)
+        with self.lock:
+            self._put_memory(key, vector)
+            if self.db is not None:
+                self._put_disk(key, vector)
+
+    def _put_memory(self, key, vector):
+        self.items[key] = vector
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def _put_disk(self, key, vector):
+        exists = self.db.execute("SELECT 1 FROM embeddings WHERE key = ?", (key,)).fetchone() is not None
+        self.db.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)",
+            (key, vector.tobytes(), time.time()))
+        if not exists:
+            self.disk_count += 1
+        if self.disk_count > self.max_disk_items:
+            overflow = self.disk_count - self.max_disk_items
+            self.db.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY accessed LIMIT ?)",
+                (overflow,))
+            self.disk_count = self.db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+        self.db.commit()
+
+    def encode(self, texts, encode_fn, instruction=None):
+        """Return the embeddings of `texts`, calling `encode_fn` only for the cache misses"""
+        vectors = [self.get(text, instruction) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = encode_fn([texts[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                self.put(texts[i], vector, instruction)
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        return vectors
+
+    def stats(self):
+        return {
+            "model_name": self.model_name,
+            "items": len(self.items),
+            "max_items": self.max_items,
+            "disk_items": self.disk_count if self.db is not None else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -1,5 +1,9 @@
 import os
+import time
+import queue
+import threading
 from pathlib import Path
+from concurrent.futures import Future
 from FlagEmbedding import FlagModel, FlagReranker
 from src.config import Config, EMBED_MODEL_INFO, RERANKER_LIST
 from src.common import setup_logger, hashstr
@@ -39,8 +43,27 @@ class EmbeddingModel(FlagModel):
             **kwargs
         )
         
+        self.cache = None
+        if config.enable_embedding_cache:
+            from src.models.cache import EmbeddingCache
+            self.cache = EmbeddingCache(
+                model_info["name"],
+                max_items=int(config.embedding_cache_size or 10000),
+                cache_dir=os.path.join(config.save_dir, "cache") if config.embedding_cache_persist else None)
+
         logger.info(f"Embedding model {model_info['name']} loaded")
 
+    def encode_cached(self, texts):
+        if self.cache is None:
+            return self.encode(texts)
+        return self.cache.encode(texts, self.encode)
+
+    def encode_queries_cached(self, queries):
+        if self.cache is None:
+            return self.encode_queries(queries)
+        instruction = getattr(self, "query_instruction_for_retrieval", None)
+        return self.cache.encode(queries, self.encode_queries, instruction=instruction)
+
 class Reranker(FlagReranker):
 
     def __init__(
@@ -60,10 +83,73 @@ class Reranker(FlagReranker):
         logger.info(f"Loading Reranker model {config.reranker} from {model_name_or_path}")
 
         super().__init__(model_name_or_path, use_fp16=True, **kwargs)
+        self.batch_size = int(config.reranker_batch_size or 32)
         logger.info(f"Reranker model {config.reranker} loaded")
 
+    def score_pairs(self, pairs):
+        """Score all [query, passage] pairs in one batched call"""
+        if not pairs:
+            return []
+        scores = self.compute_score(pairs, batch_size=self.batch_size, normalize=True)
+        return scores if isinstance(scores, list) else [scores]
+
+class RerankBatcher:
+    """Merge rerank jobs of concurrent requests arriving within `window_ms` into one forward call"""
+
+    def __init__(
+        self,
+        reranker: Reranker,
+        window_ms: float = 5,
+        max_pairs: int = None
+    ):
+        self.reranker = reranker
+        self.window = window_ms / 1000
+        self.max_pairs = int(max_pairs or reranker.batch_size)  # reranker_batch_size by default
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self.worker.start()
+
+    def score_pairs(self, pairs):
+        if not pairs:
+            return []
+        future = Future()
+        self.jobs.put((pairs, future))
+        return future.result()
+
+    def _collect(self):
+        jobs = [self.jobs.get()]
+        size = len(jobs[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_pairs:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job[0])
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            pairs = [pair for job_pairs, _ in jobs for pair in job_pairs]
+            try:
+                scores = self.reranker.score_pairs(pairs)
+            except Exception as e:
+                logger.error(f"Failed to rerank {len(pairs)} pairs: {e}")
+                for _, future in jobs:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for job_pairs, future in jobs:
+                future.set_result(scores[offset:offset + len(job_pairs)])
+                offset += len(job_pairs)
+
 from zhipuai import ZhipuAI
-GLOBAL_EMBED_STATE = {}
 class ZhipuEmbedding:
 
     def __init__(
@@ -84,20 +170,9 @@ class ZhipuEmbedding:
         data = []
         batch_size = 20
 
-        if len(message) > batch_size:
-            global GLOBAL_EMBED_STATE
-            task_id = hashstr(message)
-            logger.info(f"Creating new state for process {task_id}")
-            GLOBAL_EMBED_STATE[task_id] = {
-                'status': 'in-progress',
-                'total': len(message),
-                'progress': 0
-            }
-
         for i in range(0, len(message), batch_size):
             if len(message) > batch_size:
                 logger.info(f"Encoding {i} to {i+batch_size} with {len(message)} messages")
-                GLOBAL_EMBED_STATE[task_id]['progress'] = i
 
             group_msg = message[i:i+batch_size]
             response = self.client.embeddings.create(
@@ -107,10 +182,6 @@ class ZhipuEmbedding:
 
             data.extend([a.embedding for a in response.data])
 
-        if len(message) > batch_size:
-            GLOBAL_EMBED_STATE[task_id]['progress'] = len(message)
-            GLOBAL_EMBED_STATE[task_id]['status'] = 'completed'
-
         return data
 def get_embedding_model(
     config: Config
@@ -1,12 +1,23 @@
 import os
-from openai import OpenAI
+import asyncio
+from openai import OpenAI, AsyncOpenAI
 
 from src.common import setup_logger
 logger = setup_logger("LanguageModel")
 
+async def _aiter_in_thread(iterator):
+    """Consume a blocking iterator from a worker thread, one item at a time"""
+    sentinel = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, sentinel)
+        if item is sentinel:
+            break
+        yield item
+
 class OpenAIBase():
     def __init__(self, api_key, base_url, model_name):
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
         self.model_name = model_name
 
     def predict(self, message, stream=False):
@@ -37,6 +48,34 @@ class OpenAIBase():
         )
         return response.choices[0].message
 
+    def apredict(self, message, stream=False):
+        if isinstance(message, str):
+            messages=[{"role": "user", "content": message}]
+        else:
+            messages = message
+
+        if stream:
+            return self._astream_response(messages)
+        else:
+            return self._aget_response(messages)
+
+    async def _astream_response(self, messages):
+        response = await self.async_client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=True,
+        )
+        async for chunk in response:
+            yield chunk.choices[0].delta
+
+    async def _aget_response(self, messages):
+        response = await self.async_client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=False,
+        )
+        return response.choices[0].message
+
 
 class OpenModel(OpenAIBase):
     def __init__(self, model_name=None):
@@ -115,6 +154,12 @@ class Qianfan:
         )
         return GeneralResponse(response["body"]["result"])
 
+    def apredict(self, message, stream=False):
+        if stream:
+            return _aiter_in_thread(self.predict(message, stream=True))
+        else:
+            return asyncio.to_thread(self.predict, message)
+
 class DashScope:
 
     def __init__(self, model_name="qwen-max-latest") -> None:
@@ -157,6 +202,12 @@ class DashScope:
         )
         return response.output.choices[0].message
 
+    def apredict(self, message, stream=False):
+        if stream:
+            return _aiter_in_thread(self.predict(message, stream=True))
+        else:
+            return asyncio.to_thread(self.predict, message)
+
 if __name__ == "__main__":
     model = SiliconFlow()
     for a in model.predict("你好", stream=True):
@@ -1,2 +1,10 @@
-from src.plugins.oneke import *
-from src.plugins.pdf2txt import *
\ No newline at end of file
+from src.plugins.pdf2txt import *
+
+
+def __getattr__(name):
+    # OneKE pulls in torch / transformers, it is only imported when asked for,
+    # so that importing the pdf tools (e.g. in parse workers) stays light
+    if name == "OneKE":
+        from src.plugins.oneke import OneKE
+        return OneKE
+    raise AttributeError(f"module 'src.plugins' has no attribute '{name}'")
@@ -1,127 +1,255 @@
 import os
-import uuid
+import time
+import threading
 import fitz  # pip install PyMuPDF
-from PIL import Image
+import atexit
+import multiprocessing
 from copy import deepcopy
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
 from src.common import logger, is_text_pdf
+from src.common.parse_cache import PARSE_CACHE
 import numpy as np  # Added import for numpy
 
-GOLBAL_STATE = {}
+class OCRService:
+    """
+    Long-lived PPStructure engine shared inside a process.
+    The engine is loaded on first use, inference is serialized by a lock and at most
+    `queue_size` requests may be waiting for it, further requests time out after `timeout` seconds.
+    """
 
-def pdf2txt(pdf_path, return_text=False):
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"File not found: {pdf_path}")
+    def __init__(self, queue_size=8, timeout=600):
+        self.engine = None
+        self.timeout = timeout
+        self.load_lock = threading.Lock()
+        self.infer_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.load_time = None
+        self.pages = 0
+        self.page_times = deque(maxlen=1000)
+        self.worker_load_times = []
 
-    if is_text_pdf(pdf_path):
-        return pdfreader(pdf_path)
+    def get_engine(self):
+        if self.engine is None:
+            with self.load_lock:
+                if self.engine is None:
+                    from paddleocr import PPStructure
+                    start = time.perf_counter()
+                    self.engine = PPStructure(recovery=True, lang='ch', show_log=False)
+                    self.load_time = time.perf_counter() - start
+                    logger.info(f"OCR engine loaded in {self.load_time:.2f}s")
+        return self.engine
 
-    # Importing these modules here to avoid unnecessary imports in other files
-    from paddleocr import PPStructure, save_structure_res
-    from paddleocr.ppstructure.recovery.recovery_to_doc import sorted_layout_boxes, convert_info_docx
-    filename =  os.path.basename(pdf_path).split('.')[0]
-    output_dir = os.path.join('saves', 'data', 'pdf2txt', filename)
-    os.makedirs(output_dir, exist_ok=True)
+    def __call__(self, img):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise TimeoutError("OCR request queue is full")
+        try:
+            engine = self.get_engine()
+            with self.infer_lock:
+                start = time.perf_counter()
+                result = engine(img)
+                self.page_times.append(time.perf_counter() - start)
+                self.pages += 1
+            return result
+        finally:
+            self.slots.release()
+
+    def record(self, page_times, load_time=None):
+        """Count pages recognized by the engine of another process (the ingestion parse workers)"""
+        with self.infer_lock:
+            self.page_times.extend(page_times)
+            self.pages += len(page_times)
+            if load_time is not None:
+                self.worker_load_times.append(load_time)
+
+    def metrics(self):
+        times = sorted(self.page_times)
+        percentile = lambda q: round(times[min(int(q * len(times)), len(times) - 1)], 4) if times else None
+        return {
+            "loaded": self.engine is not None,
+            "load_time": self.load_time,
+            "worker_engines": len(self.worker_load_times),
+            "worker_load_time_avg": round(sum(self.worker_load_times) / len(self.worker_load_times), 4)
+                if self.worker_load_times else None,
+            "pages": self.pages,
+            "page_time_avg": round(sum(times) / len(times), 4) if times else None,
+            "page_time_p50": percentile(0.5),
+            "page_time_p95": percentile(0.95),
+        }
 
-    table_engine = PPStructure(recovery=True, lang='ch')
+OCR_SERVICE = OCRService(
+    queue_size=int(os.getenv("OCR_QUEUE_SIZE", 8)),
+    timeout=float(os.getenv("OCR_QUEUE_TIMEOUT", 600)))
 
-    imgs = convert_imgs(pdf_path, output_dir)
+def pdf2txt(
+    pdf_path,
+    return_text=False,
+    progress=None,
+    workers=None,
+    save_docx=False,
+    save_structure=False
+):
+    """
+    OCR a scanned pdf, pages are rendered in memory and recognized by the shared OCR_SERVICE,
+    or by `workers` processes each holding its own engine. The text is joined in page order.
+    The DOCX / structure_result outputs are only written when asked for.
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"File not found: {pdf_path}")
+
+    digest = PARSE_CACHE.file_hash(pdf_path)
+    filename =  os.path.basename(pdf_path).split('.')[0]
+    output_dir = os.path.join('saves', 'data', 'pdf2txt', f"{filename}_{digest[:8]}")
     respath = os.path.join(output_dir, f'{filename}.txt')
 
-    global GOLBAL_STATE
-    task_id = str(uuid.uuid4())
-    if task_id in GOLBAL_STATE:
-        logger.info(f"Reusing previous state for process {task_id}")
-        return GOLBAL_STATE[task_id]
-    else:
-        logger.info(f"Creating new state for process {task_id}")
-        GOLBAL_STATE[task_id] = {
-            'pdf_path': pdf_path,
-            'return_text': return_text,
-            'output_dir': output_dir,
-            'status': 'in-progress',
-            'total': len(imgs),
-            'progress': 0
-        }
+    whole_text = PARSE_CACHE.get_document(digest)
+    if whole_text is not None:
+        logger.info(f"Read {pdf_path} from parse cache {digest[:8]}")
+        if return_text:
+            return whole_text
+        os.makedirs(output_dir, exist_ok=True)
+        with open(respath, 'w', encoding='utf-8') as f:
+            f.write(whole_text)
+        return respath
 
+    if is_text_pdf(pdf_path):
+        whole_text = pdfreader(pdf_path)
+        PARSE_CACHE.put_document(digest, whole_text)
+        return whole_text
 
-    text = []
-    for img_name in tqdm(imgs, desc='to txt', ncols=100):
-        img = Image.open(img_name)
-        img = np.array(img)  # 如果需要将图像转换为numpy数组
-        result = table_engine(img)
-        GOLBAL_STATE[task_id]['progress'] += 1
+    os.makedirs(output_dir, exist_ok=True)
 
-        save_structure_res(result, output_dir, "structure_result")
+    workers = int(workers or os.getenv("OCR_WORKERS", 1))
+    with fitz.open(pdf_path) as doc:
+        total = doc.page_count
+    outputs = (output_dir if save_docx else None, output_dir if save_structure else None, digest)
 
-        res = sorted_layout_boxes(result, img.shape[1])
+    texts = [None] * total
+    with tqdm(total=total, desc='to txt', ncols=100) as bar:
+        if workers > 1 and total > 1:
+            pool = get_ocr_pool(workers)
+            futures = {pool.submit(_ocr_page_in_worker, pdf_path, pg, *outputs): pg for pg in range(total)}
+            for done, future in enumerate(as_completed(futures)):
+                texts[futures[future]], metrics = future.result()
+                if metrics:
+                    OCR_SERVICE.record(**metrics)
+                bar.update(1)
+                if progress:
+                    progress("ocr", done + 1, total)
+        else:
+            for pg in range(total):
+                if progress:
+                    progress("ocr", pg + 1, total)
+                texts[pg] = ocr_page(pdf_path, pg, *outputs)
+                bar.update(1)
 
-        try:
-            convert_info_docx(img, res, output_dir, "info")
-        except Exception as e:
-            print(f"Exception occurred while converting to DOCX: {e}")
-            continue  # Skip this image if conversion fails
-
-        for line in res:
-            line.pop('img') # okk
-            for pra in line['res']:
-                if isinstance(pra, dict) and 'text' in pra:
-                    text.append(pra['text'])
-                else:
-                    continue  # 如果不是字典或者缺少 'text' 键，跳过当前循环
-            text.append('\n')
-
-    whole_text = ''.join(text)
+    whole_text = ''.join(texts)
+    PARSE_CACHE.put_document(digest, whole_text)
     with open(respath, 'w', encoding='utf-8') as f:
         f.write(whole_text)
         logger.info(f"Extracted text saved to {respath}")
 
-    GOLBAL_STATE[task_id]['status'] = 'completed'
-
     if return_text:
         return whole_text
 
     return respath
 
-def convert_imgs(pdf_path, output_dir):
-    imgs = []
-    img_dir = os.path.join(output_dir, 'imgs')
-    if not os.path.exists(img_dir):
-        os.makedirs(img_dir)
-        pdfDoc = fitz.open(pdf_path)
-        totalPage = pdfDoc.page_count
-        for pg in tqdm(range(totalPage), desc='to imgs', ncols=100):
-            page = pdfDoc[pg]
-            rotate = int(0)
-            zoom_x = 2
-            zoom_y = 2
-            mat = fitz.Matrix(zoom_x, zoom_y).prerotate(rotate)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img_filename = os.path.join(img_dir, f'images_{pg+1}.png')
-            pix.save(img_filename)  # os.sep
-            imgs.append(img_filename)
-    else:
-        img_names = sorted(os.listdir(img_dir))
-        imgs = [os.path.join(img_dir, img_name) for img_name in img_names]
-
-    return imgs
-
-def get_state(task_id):
-    return GOLBAL_STATE.get(task_id, {})
+_OCR_POOL = None
+_OCR_POOL_LOCK = threading.Lock()
 
+def get_ocr_pool(workers):
+    """Process pool shared by the pdf2txt calls, its workers keep their OCR engine warm.
+    The pool is rebuilt only when more workers are asked for than it has."""
+    global _OCR_POOL
+    with _OCR_POOL_LOCK:
+        if _OCR_POOL is None or _OCR_POOL._max_workers < workers:
+            if _OCR_POOL is not None:
+                _OCR_POOL.shutdown(wait=False)
+            ctx = multiprocessing.get_context("spawn")
+            _OCR_POOL = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        return _OCR_POOL
 
-def pdfreader(file_path):
-    """读取PDF文件并返回text文本"""
-    assert os.path.exists(file_path), "File not found"
-    assert file_path.endswith(".pdf"), "File format not supported"
+@atexit.register
+def _shutdown_ocr_pool():
+    if _OCR_POOL is not None:
+        _OCR_POOL.shutdown(wait=False, cancel_futures=True)
+
+_DOCS = OrderedDict()
+_DOCS_LOCK = threading.Lock()
+MAX_OPEN_DOCS = 4
+
+def render_page(pdf_path, pg, zoom=2):
+    """Render a pdf page to an RGB ndarray without writing it to disk.
+    The document stays open in the process for the following pages, keyed by path and mtime."""
+    key = (os.path.abspath(pdf_path), os.path.getmtime(pdf_path))
+    with _DOCS_LOCK:
+        doc = _DOCS.get(key)
+        if doc is None:
+            doc = _DOCS[key] = fitz.open(pdf_path)
+            while len(_DOCS) > MAX_OPEN_DOCS:
+                _DOCS.popitem(last=False)[1].close()
+        _DOCS.move_to_end(key)
+        pix = doc[pg].get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n).copy()
+
+def ocr_page(pdf_path, pg, docx_dir=None, structure_dir=None, digest=None):
+    """OCR one page and return its text with the shared engine of the current process,
+    pages already in the parse cache under `digest` are not recognized again"""
+    if digest and not (docx_dir or structure_dir):
+        text = PARSE_CACHE.get_page(digest, pg)
+        if text is not None:
+            return text
+
+    # Importing these modules here to avoid unnecessary imports in other files
+    from paddleocr import save_structure_res
+    from paddleocr.ppstructure.recovery.recovery_to_doc import sorted_layout_boxes, convert_info_docx
+
+    img = render_page(pdf_path, pg)
+    result = OCR_SERVICE(img)
 
-    from llama_index.readers.file import PDFReader
-    doc = PDFReader().load_data(file=Path(file_path))
-    text = "\n\n".join([d.get_content() for d in doc])
+    if structure_dir:
+        save_structure_res(result, structure_dir, "structure_result")
+
+    res = sorted_layout_boxes(result, img.shape[1])
+
+    if docx_dir:
+        try:
+            convert_info_docx(img, res, docx_dir, f"info_{pg+1}")
+        except Exception as e:
+            logger.warning(f"Exception occurred while converting page {pg+1} to DOCX: {e}")
+
+    text = []
+    for line in res:
+        line.pop('img', None)
+        for pra in line['res']:
+            if isinstance(pra, dict) and 'text' in pra:
+                text.append(pra['text'])
+        text.append('\n')
+
+    text = ''.join(text)
+    if digest:
+        PARSE_CACHE.put_page(digest, pg, text)
     return text
 
+def _ocr_page_in_worker(*args):
+    """`ocr_page` in a pool worker, the timings of its engine are returned for the metrics of the parent"""
+    pages, loaded = OCR_SERVICE.pages, OCR_SERVICE.engine is not None
+    text = ocr_page(*args)
+    if OCR_SERVICE.pages == pages:
+        return text, None  # served from the parse cache
+    return text, {
+        "page_times": list(OCR_SERVICE.page_times)[-(OCR_SERVICE.pages - pages):],
+        "load_time": OCR_SERVICE.load_time if not loaded else None,
+    }
+
+def pdfreader(file_path):
+    """读取PDF文件并返回text文本"""
+    from src.common.reader import pdfreader as _pdfreader
+    return _pdfreader(file_path)
+
 def plainreader(file_path):
     """读取普通文本文件并返回text文本"""
     assert os.path.exists(file_path), "File not found"
@@ -136,6 +264,10 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('--pdf-path', type=str, required=True, help='Path to the PDF file')
     parser.add_argument('--return-text', action='store_true', help='Return the extracted text')
+    parser.add_argument('--workers', type=int, default=1, help='Number of OCR processes')
+    parser.add_argument('--save-docx', action='store_true', help='Save the recovered DOCX')
+    parser.add_argument('--save-structure', action='store_true', help='Save the structure results')
     args = parser.parse_args()
 
-    pdf2txt(args.pdf_path, args.return_text)
+    pdf2txt(args.pdf_path, args.return_text, workers=args.workers,
+            save_docx=args.save_docx, save_structure=args.save_structure)
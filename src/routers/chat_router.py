@@ -1,15 +1,14 @@
 import json
+import time
 import asyncio
 from fastapi import APIRouter, Body
 from fastapi.responses import StreamingResponse, Response
-from concurrent.futures import ThreadPoolExecutor
 from src.core import HistoryManager
 from src.core.soap import soap
 from src.common import setup_logger
 
 chat = APIRouter(prefix="/chat")
 logger = setup_logger("server-chat")
-executor = ThreadPoolExecutor()
 refs_pool = {}
 
 @chat.get("/")
@@ -17,30 +16,61 @@ async def chat_get():
     return "Chat Get!"
 
 @chat.post("/")
-def chat_post(
+async def chat_post(
         query: str = Body(...),
         meta: dict = Body(None),
         history: list = Body(...),
         cur_res_id: str = Body(...)):
+    """
+    Streaming options negotiated via `meta` (all optional, defaults keep the legacy format):
+    - stream_mode: "full" resends the accumulated response and history per chunk,
+      "delta" sends only the new text and the history once in the final "finished" chunk;
+    - sse: frame chunks as Server-Sent Events instead of JSON lines;
+    - coalesce_ms / coalesce_chars: merge tiny deltas until the time or size window is reached.
+    """
 
     history_manager = HistoryManager(history)
+    cache = soap.response_cache if meta.get("use_cache", True) else None
+    delta_mode = meta.get("stream_mode", "full") == "delta"
+    use_sse = bool(meta.get("sse"))
+    coalesce_ms = float(meta.get("coalesce_ms") or 0)
+    coalesce_chars = int(meta.get("coalesce_chars") or 0)
+
+    def frame(payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return b"data: " + data + b"\n\n" if use_sse else data + b"\n"
 
     def make_chunk(content, status, history):
-        return json.dumps({
+        return frame({
             "response": content,
             "history": history,
             "model_name": soap.config.model_name,
             "status": status,
             "meta": meta,
-        }, ensure_ascii=False).encode('utf-8') + b"\n"
+        })
 
-    def generate_response():
+    def make_delta(delta, status):
+        return frame({
+            "delta": delta,
+            "model_name": soap.config.model_name,
+            "status": status,
+        })
+
+    def make_final(content):
+        return frame({
+            "history": history_manager.update_ai(content),
+            "model_name": soap.config.model_name,
+            "status": "finished",
+            "meta": meta,
+        })
+
+    async def generate_response():
 
         if meta.get("enable_retrieval"):
             chunk = make_chunk("", "searching", history=None)
             yield chunk
 
-            new_query, refs = soap.retriever(query, history_manager.messages, meta)
+            new_query, refs = await soap.retriever(query, history_manager.messages, meta)
             refs_pool[cur_res_id] = refs
         else:
             new_query = query
@@ -49,30 +79,77 @@ def chat_post(
         history_manager.add_user(query)
         logger.debug(f"Web history: {history_manager.messages}")
 
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, messages, soap.config.model_name, query)
+            if cached is not None:
+                if delta_mode:
+                    yield make_delta(cached, "loading")
+                    yield make_final(cached)
+                else:
+                    yield make_chunk(cached, "loading", history=history_manager.update_ai(cached))
+                return
+
         content = ""
-        for delta in soap.model.predict(messages, stream=True):
+        pending = ""  # text received since the last flushed chunk
+        last_flush = time.monotonic()
+        async for delta in soap.model.apredict(messages, stream=True):
             if not delta.content:
                 continue
 
             if hasattr(delta, 'is_full') and delta.is_full:
-                content = delta.content
+                new_content = delta.content
             else:
-                content += delta.content
+                new_content = content + delta.content
 
-            chunk = make_chunk(content, "loading", history=history_manager.update_ai(content))
-            yield chunk
+            if delta_mode and not new_content.startswith(content):
+                # the provider rewrote the response, resend it as a whole
+                content, pending = new_content, ""
+                last_flush = time.monotonic()
+                yield make_chunk(content, "loading", history=None)
+                continue
+
+            pending += new_content[len(content):]
+            content = new_content
 
-    return StreamingResponse(generate_response(), media_type='application/json')
+            window_reached = (coalesce_ms and (time.monotonic() - last_flush) * 1000 >= coalesce_ms) \
+                or (coalesce_chars and len(pending) >= coalesce_chars)
+            if (coalesce_ms or coalesce_chars) and not window_reached:
+                continue
+
+            if delta_mode:
+                yield make_delta(pending, "loading")
+            else:
+                yield make_chunk(content, "loading", history=history_manager.update_ai(content))
+            pending = ""
+            last_flush = time.monotonic()
+
+        if delta_mode:
+            if pending:
+                yield make_delta(pending, "loading")
+            yield make_final(content)
+        elif pending:
+            yield make_chunk(content, "loading", history=history_manager.update_ai(content))
+
+        if cache is not None:
+            await asyncio.to_thread(cache.put, messages, soap.config.model_name, content, query)
+
+    media_type = 'text/event-stream' if use_sse else 'application/json'
+    return StreamingResponse(generate_response(), media_type=media_type)
 
 @chat.post("/call")
 async def call(query: str = Body(...), meta: dict = Body(None)):
-    async def predict_async(query):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(executor, soap.model.predict, query)
+    cache = soap.response_cache if (meta or {}).get("use_cache", True) else None
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, query, soap.config.model_name)
+        if cached is not None:
+            return {"response": cached}
 
-    response = await predict_async(query)
+    response = await soap.model.apredict(query)
     logger.debug({"query": query, "response": response.content})
 
+    if cache is not None:
+        await asyncio.to_thread(cache.put, query, soap.config.model_name, response.content)
+
     return {"response": response.content}
 
 @chat.get("/refs")
@@ -1,6 +1,9 @@
 import os
+import json
+import asyncio
 from typing import List, Optional
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Body
+from fastapi.responses import StreamingResponse
 
 from src.common import setup_logger, hashstr
 from src.core.soap import soap
@@ -42,7 +45,7 @@ async def delete_database(db_id):
 @data.post("/query-test")
 async def query_test(query: str = Body(...), meta: dict = Body(...)):
     logger.debug(f"Query test in {meta}: {query}")
-    result = soap.retriever.query_knowledgebase(query, history=None, refs={"meta": meta})
+    result = await soap.retriever.aquery_knowledgebase(query, history=None, refs={"meta": meta})
     return result
 
 @data.post("/add-by-file")
@@ -51,6 +54,59 @@ async def create_document_by_file(db_id: str = Body(...), files: List[str] = Bod
     msg = soap.dbm.add_files(db_id, files)
     return msg
 
+@data.post("/upsert-by-file")
+async def upsert_document_by_file(db_id: str = Body(...), file_id: str = Body(...), file: str = Body(...)):
+    logger.debug(f"Upsert document {file_id} in {db_id} by file: {file}")
+    msg = soap.dbm.upsert_file(db_id, file_id, file)
+    return msg
+
+@data.post("/search-profile")
+async def set_search_profile(db_id: str = Body(...), search_profile: str = Body(...)):
+    logger.debug(f"Set search profile of {db_id} to {search_profile}")
+    return soap.dbm.set_search_profile(db_id, search_profile)
+
+@data.post("/migrate")
+async def migrate_database(db_id: Optional[str] = Body(None, embed=True)):
+    logger.debug(f"Migrate database {db_id or 'all'} to the explicit schema")
+    return soap.dbm.migrate_database(db_id)
+
+@data.get("/jobs")
+async def get_jobs(db_id: Optional[str] = None):
+    jobs = soap.dbm.jobs.list()
+    if db_id:
+        jobs = [job for job in jobs if job["payload"].get("db_id") == db_id]
+    return {"jobs": jobs}
+
+@data.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = soap.dbm.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@data.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, interval: float = 0.5):
+    if soap.dbm.jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def generate_progress():
+        last = None
+        while True:
+            job = soap.dbm.jobs.get(job_id)
+            if job is None:
+                # evicted from the registry while streaming
+                yield json.dumps({"job_id": job_id, "status": "not_found"}).encode('utf-8') + b"\n"
+                break
+            chunk = json.dumps(job, ensure_ascii=False)
+            if chunk != last:
+                last = chunk
+                yield chunk.encode('utf-8') + b"\n"
+            if job["status"] in ["done", "failed"]:
+                break
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(generate_progress(), media_type='application/json')
+
 @data.get("/info")
 async def get_database_info(db_id: str):
     logger.debug(f"Get database {db_id} info")
@@ -62,8 +118,8 @@ async def get_database_info(db_id: str):
 @data.delete("/document")
 async def delete_document(db_id: str = Body(...), file_id: str = Body(...)):
     logger.debug(f"DELETE document {file_id} info in {db_id}")
-    soap.dbm.delete_file(db_id, file_id)
-    return {"message": "删除成功"}
+    msg = soap.dbm.delete_file(db_id, file_id)
+    return msg or {"message": "删除成功"}
 
 @data.get("/document")
 async def get_document_info(db_id: str, file_id: str):
@@ -93,16 +149,30 @@ async def upload_file(file: UploadFile = File(...)):
 
     return {"message": "File successfully uploaded", "file_path": file_path}
 
+@data.get("/embedding-cache")
+async def get_embedding_cache_stats():
+    cache = getattr(soap.dbm.embed_model, "cache", None)
+    if cache is None:
+        return {"message": "Embedding cache not enabled", "stats": {}}
+    return {"message": "success", "stats": cache.stats()}
+
 @data.get("/graph")
 async def get_graph_info():
     graph_info = soap.dbm.get_graph()
     return graph_info
 
 @data.get("/graph/node")
-async def get_graph_node(entity_name: str):
+async def get_graph_node(entity_name: str,
+                         hops: int = 2,
+                         fanout: Optional[int] = None,
+                         budget: Optional[int] = None,
+                         rel_types: Optional[str] = None,
+                         rank_by: Optional[str] = None):
     logger.debug(f"Get graph node {entity_name}")
-    result = soap.dbm.graph_base.query_node(entity_name=entity_name)
-    return {"result": soap.retriever.format_query_results(result), "message": "success"}
+    result = soap.dbm.graph_base.query_node(
+        entity_name=entity_name, hops=hops, fanout=fanout, budget=budget,
+        rel_types=rel_types.split(",") if rel_types else None, rank_by=rank_by)
+    return {"result": result, "message": "success"}
 
 @data.get("/graph/nodes")
 async def get_graph_nodes(kgdb_name: str, num: int):
@@ -118,9 +188,13 @@ async def add_graph_entity(file_path: str = Body(...), kgdb_name: Optional[str]
     if not soap.config.enable_knowledge_graph:
         raise HTTPException(status_code=400, detail="Knowledge graph is not enabled")
 
-    if not file_path.endswith('.jsonl'):
-        raise HTTPException(status_code=400, detail="file_path must be a jsonl file")
+    if file_path.endswith('.jsonl'):
+        await asyncio.to_thread(soap.dbm.graph_base.jsonl_file_add_entity, file_path, kgdb_name)
+    elif file_path.endswith('.json'):
+        # structured node files such as data/node/herbs.json
+        await asyncio.to_thread(soap.dbm.graph_base.json_file_add_nodes, file_path, kgdb_name)
+    else:
+        raise HTTPException(status_code=400, detail="file_path must be a jsonl or json file")
 
-    soap.dbm.graph_base.jsonl_file_add_entity(file_path, kgdb_name)
     return {"message": "Entity successfully added"}
 
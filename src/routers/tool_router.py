@@ -1,4 +1,5 @@
 import os
+import asyncio
 from fastapi import APIRouter, Body
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
@@ -46,5 +47,10 @@ async def text_chunking(text: str = Body(...), params: Dict[str, Any] = Body(...
 @tool.post("/pdf2txt")
 async def handle_pdf2txt(file: str = Body(...)):
     from src.plugins import pdf2txt
-    text = pdf2txt(file, return_text=True)
+    text = await asyncio.to_thread(pdf2txt, file, return_text=True)
     return {"text": text}
+
+@tool.get("/ocr/metrics")
+async def get_ocr_metrics():
+    from src.plugins.pdf2txt import OCR_SERVICE
+    return OCR_SERVICE.metrics()
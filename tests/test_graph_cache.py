@@ -0,0 +1,48 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.core.graph_cache import GraphCache
+
+
+def unit(angle):
+    """2-d unit vector at `angle` radians from the query direction (1, 0)"""
+    return [math.cos(angle), math.sin(angle)]
+
+
+def neo4j_score(cosine):
+    """Score yielded by `db.index.vector.queryNodes` for a cosine index"""
+    return (1 + cosine) / 2
+
+
+@pytest.fixture
+def cache():
+    cache = GraphCache()
+    # cosine to the query: 1.0, 0.85, 0.7, -0.2
+    for name, cosine in [("a", 1.0), ("b", 0.85), ("c", 0.7), ("d", -0.2)]:
+        cache.upsert_node(f"id-{name}", name, unit(math.acos(cosine)))
+    return cache
+
+
+def test_search_uses_the_neo4j_threshold_scale(cache):
+    threshold = 0.9
+    seeds = cache.search([[1.0, 0.0]], num_of_res=10, threshold=threshold)
+    names = [cache.names[idx] for idx in seeds]
+
+    # the Cypher seed query keeps `score > $threshold` with score = (1 + cos) / 2
+    expected = [name for name, cosine in [("a", 1.0), ("b", 0.85), ("c", 0.7), ("d", -0.2)]
+                if neo4j_score(cosine) > threshold]
+    assert names == expected == ["a", "b"]
+
+
+def test_search_ranks_and_limits_like_the_index(cache):
+    seeds = cache.search([[1.0, 0.0]], num_of_res=3, threshold=0.0)
+    assert [cache.names[idx] for idx in seeds] == ["a", "b", "c"]
+
+
+def test_search_without_results(cache):
+    assert cache.search([[1.0, 0.0]], num_of_res=0) == []
+    assert cache.search([], num_of_res=5) == []
+    assert GraphCache().search([[1.0, 0.0]]) == []